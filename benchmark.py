@@ -0,0 +1,267 @@
+# MIT License
+# Copyright (c) 2018 Devang Thakkar
+# https://www.devangthakkar.com
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# PEP-8 format: Limit all lines to a maximum of 79 characters ----------------|
+
+# Python Standard Modules
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import tempfile
+import time
+import timeit
+
+# Import FlowChart
+from flowchart import FlowChart, FlowChartError, import_graphviz
+
+# shapes of the synthetic hierarchies, see write_hierarchy
+SHAPES = ("random", "chain", "fan_in", "fallback")
+
+# number of predecessors of the "+" groups of fan_in hierarchies, and of the
+# "," groups of fallback hierarchies
+GROUP_WIDTH = 16
+
+
+def write_hierarchy(file_name, nb_steps, shape="random", seed=0):
+    """
+    This function writes a synthetic hierarchy file of nb_steps steps. The
+    first steps mirror the top of the dnaseq hierarchy, every following step
+    links to earlier steps according to shape:
+
+    - random: a single predecessor, a "," group or a "+" group of up to three
+    of the ten previous steps
+
+    - chain: the previous step only
+
+    - fan_in: a "+" group of GROUP_WIDTH earlier steps, picked anywhere
+
+    - fallback: a "," group of the GROUP_WIDTH previous steps, the nearest
+    one preferred
+
+    Parameters
+    ----------
+    file_name: path
+        Name of the hierarchy file to write
+    nb_steps: int
+        Number of steps in the hierarchy
+    shape: string
+        One of SHAPES
+    seed: int
+        Seed of the random generator, for reproducible hierarchies
+    """
+
+    rand = random.Random(seed)
+
+    with open(file_name, "w") as f:
+        f.write("BAM\t1:step_1\n")
+        f.write("FASTQ,1\t2:step_2\n")
+        for step in range(3, nb_steps + 1):
+
+            if shape == "chain":
+                predecessor_term = str(step - 1)
+
+            elif shape == "fan_in":
+                size = min(GROUP_WIDTH, step - 1)
+                predecessor_term = "+".join(
+                    str(i) for i in sorted(rand.sample(range(1, step), size)))
+
+            elif shape == "fallback":
+                predecessor_term = ",".join(
+                    str(i) for i in range(step - 1,
+                                          max(0, step - 1 - GROUP_WIDTH), -1))
+
+            else:
+                # pick up to three predecessors among the ten previous steps
+                low = max(1, step - 10)
+                size = min(rand.randint(1, 3), step - low)
+                predecessors = [str(i)
+                                for i in rand.sample(range(low, step), size)]
+
+                if len(predecessors) == 1 or rand.random() < 0.5:
+                    predecessor_term = ",".join(predecessors)
+                else:
+                    predecessor_term = "+".join(predecessors)
+
+            f.write(predecessor_term + "\t" + str(step) + ":step_" +
+                    str(step) + "\n")
+
+
+def can_render():
+    """
+    This function checks that flowcharts can be rendered, i.e. that both the
+    graphviz package and the Graphviz dot executable are installed.
+
+    Parameters
+    ----------
+
+    Returns
+    ----------
+    boolean
+        True if flowcharts can be rendered
+    """
+
+    try:
+        import_graphviz()
+    except FlowChartError:
+        return False
+
+    return shutil.which("dot") is not None
+
+
+def time_stages(file_name, nb_steps, repeat, render):
+    """
+    This function times, separately, the stages of the creation of the
+    flowchart selecting all the steps of a hierarchy file: parsing the
+    hierarchy file (without the cache), parsing the steps, checking their
+    validity and building the graph, without and with rendering it, then
+    repairing the selection of the final step alone. On a chain hierarchy,
+    that repair adds every step but the first two.
+
+    Parameters
+    ----------
+    file_name: path
+        Name of the hierarchy file
+    nb_steps: int
+        Number of steps in the hierarchy
+    repeat: int
+        Number of timed runs of each stage, the best of which is kept
+    render: boolean
+        Whether to time the rendering too
+
+    Returns
+    ----------
+    dict
+        Best time, in seconds, of each stage, None for the rendering if it
+        is not timed
+    """
+
+    def best(function):
+        return min(timeit.repeat(function, number=1, repeat=repeat))
+
+    steps = "1-" + str(nb_steps)
+    chart = FlowChart(None, file_name, cache_dir=None)
+    chart.parse_steps(steps)
+
+    timings = dict()
+    timings["parse_hierarchy"] = best(
+        lambda: chart.parse_hierarchy(file_name, cache_dir=None))
+    timings["parse_steps"] = best(lambda: chart.parse_steps(steps))
+    timings["check_validity"] = best(chart.check_validity)
+    timings["build_graph"] = best(chart.build_graph)
+
+    # piping the graph always runs dot, where render may be a cache hit
+    timings["build_and_render"] = None
+    if render:
+        timings["build_and_render"] = best(
+            lambda: chart.build_graph().pipe("svg"))
+
+    # the repair is found when it is read, and must exist since both data
+    # sources are present
+    def repair():
+        if chart.build(str(nb_steps)).repair is None:
+            raise FlowChartError("no repair found for step " +
+                                 str(nb_steps) + ".")
+
+    timings["repair"] = best(repair)
+
+    return timings
+
+
+if __name__ == "__main__":
+
+    # description of parser
+    desc_string = "Benchmarking flowchart creation on synthetic hierarchies"
+    parser = argparse.ArgumentParser(description=desc_string)
+
+    # add optional argument sizes
+    parser.add_argument("--sizes", nargs="+", type=int,
+                        default=[1250, 2500, 5000, 10000],
+                        help="number of steps of the synthetic hierarchies")
+
+    # add optional argument shapes
+    parser.add_argument("--shapes", nargs="+", choices=SHAPES,
+                        default=list(SHAPES),
+                        help="shapes of the synthetic hierarchies")
+
+    # add optional argument repeat
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="number of timed runs per stage")
+
+    # add optional argument render_max
+    parser.add_argument("--render_max", type=int, default=1250,
+                        help="largest hierarchy whose flowchart is " +
+                        "rendered, 0 to never render")
+
+    # add optional argument json
+    parser.add_argument("--json", nargs=1,
+                        help="path to the JSON file the timings are " +
+                        "written to")
+
+    args = parser.parse_args()
+
+    render = args.render_max > 0 and can_render()
+    if args.render_max > 0 and not render:
+        print("Graphviz is not installed, rendering is not timed.")
+
+    stages = ("parse_hierarchy", "parse_steps", "check_validity",
+              "build_graph", "build_and_render", "repair")
+
+    # stages run for every flowchart, whose total time per step stays flat
+    # as sizes grow while the creation is linear
+    linear_stages = stages[:4]
+    results = []
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+        print("shape\tsteps\t" + "\t".join(stage + " (ms)"
+                                           for stage in stages) +
+              "\ttotal (ms)\tper step (us)")
+        for shape in args.shapes:
+            for nb_steps in args.sizes:
+                file_name = os.path.join(temp_dir, shape + "_" +
+                                         str(nb_steps) + ".tsv")
+                write_hierarchy(file_name, nb_steps, shape)
+                timings = time_stages(file_name, nb_steps, args.repeat,
+                                      render and nb_steps <= args.render_max)
+                os.remove(file_name)
+                total = sum(timings[stage] for stage in linear_stages)
+
+                results.append(dict(shape=shape, steps=nb_steps, total=total,
+                                    per_step=total / nb_steps, **timings))
+                print(shape + "\t" + str(nb_steps) + "\t" + "\t".join(
+                    "-" if timings[stage] is None else
+                    "%.2f" % (timings[stage] * 1e3) for stage in stages) +
+                    "\t" + "%.2f" % (total * 1e3) + "\t" +
+                    "%.3f" % (total * 1e6 / nb_steps))
+    finally:
+        shutil.rmtree(temp_dir)
+
+    if args.json:
+        with open(args.json[0], "w") as f:
+            json.dump({"date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                       "python": platform.python_version(),
+                       "repeat": args.repeat, "timings": results}, f,
+                      indent=2)
+        print("Timings saved to " + args.json[0] + ".")
@@ -20,6 +20,7 @@
 ################################################################################
 
 # Python Standard Modules
+import collections
 import logging
 import os
 import re
@@ -68,6 +69,29 @@ class MUGQICPipeline(Pipeline):
             self._samples = list(collections.OrderedDict.fromkeys([readset.sample for readset in self.readsets]))
         return self._samples
 
+    def config_params(self, section, *options):
+        """
+        Immutable view of config parameters of a section, for steps using them in per-sample or per-readset loops.
+        Each option is an option name, or a (name, required, type) tuple of config.param arguments.
+        The values are looked up and type-checked once, then cached for the lifetime of the pipeline:
+        the config files are only parsed at startup, so the values can not change afterwards.
+        """
+
+        if not hasattr(self, "_config_params"):
+            self._config_params = {}
+
+        key = (section,) + options
+        if key not in self._config_params:
+            names = []
+            values = []
+            for option in options:
+                name, required, type = (option, True, 'string') if isinstance(option, basestring) else option
+                names.append(name)
+                values.append(config.param(section, name, required=required, type=type))
+            # Section names are not always valid identifiers
+            self._config_params[key] = collections.namedtuple("params_" + re.sub("\W", "_", section), names)(*values)
+        return self._config_params[key]
+
     def mugqic_log(self):
         server = "http://mugqic.hpc.mcgill.ca/cgi-bin/pipeline.cgi"
         listName = {}
@@ -211,13 +235,14 @@ class Illumina(MUGQICPipeline):
         2. Else, FASTQ output files from previous picard_sam_to_fastq conversion of BAM files
         """
         jobs = []
+        params = self.config_params('trimmomatic', ('adapter_fasta', False, 'filepath'))
         for readset in self.readsets:
             trim_directory = os.path.join("trim", readset.sample.name)
             trim_file_prefix = os.path.join(trim_directory, readset.name + ".trim.")
             trim_log = trim_file_prefix + "log"
 
             # Use adapter FASTA in config file if any, else create it from readset file
-            adapter_fasta = config.param('trimmomatic', 'adapter_fasta', required=False, type='filepath')
+            adapter_fasta = params.adapter_fasta
             adapter_job = None
             if not adapter_fasta:
                 adapter_fasta = trim_file_prefix + "adapters.fa"
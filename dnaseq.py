@@ -22,6 +22,7 @@
 # Python Standard Modules
 import logging
 import math
+import multiprocessing
 import os
 import re
 import sys
@@ -51,6 +52,15 @@ from pipelines import common
 
 log = logging.getLogger(__name__)
 
+# Pipeline whose per-sample step methods are run by the sample_jobs worker processes.
+# The workers inherit it, with a snapshot of the config, when they are forked: it is never pickled.
+_sample_jobs_pipeline = None
+
+def _sample_jobs_worker(args):
+    method_name, sample_index, method_args = args
+    pipeline = _sample_jobs_pipeline
+    return getattr(pipeline, method_name)(pipeline.samples[sample_index], *method_args)
+
 class DnaSeq(common.Illumina):
     """
     DNA-Seq Pipeline
@@ -94,6 +104,184 @@ class DnaSeq(common.Illumina):
             self._sequence_dictionary = parse_sequence_dictionary_file(config.param('DEFAULT', 'genome_dictionary', type='filepath'),variant=False)
         return self._sequence_dictionary
 
+    def sample_jobs(self, method_name, *args):
+        """
+        Jobs of a step generated sample by sample by the method named method_name, called with each
+        sample followed by args. With [DEFAULT] job_generation_processes greater than 1, the samples are
+        distributed over a pool of forked processes, each one using the config as it was when the pool was created.
+        The jobs are merged in the order of the samples, so the job list is the same as with a single process.
+        """
+
+        global _sample_jobs_pipeline
+
+        nb_processes = int(config.param('DEFAULT', 'job_generation_processes', required=False) or 1)
+        nb_processes = min(nb_processes, len(self.samples))
+        if nb_processes <= 1:
+            return [job for sample in self.samples for job in getattr(self, method_name)(sample, *args)]
+
+        _sample_jobs_pipeline = self
+        pool = multiprocessing.Pool(nb_processes)
+        try:
+            # A few chunks per process keeps the pickling overhead low while balancing the load
+            chunk_size = int(math.ceil(len(self.samples) / float(nb_processes * 4)))
+            sample_job_lists = pool.map(_sample_jobs_worker, [(method_name, sample_index, args) for sample_index in xrange(len(self.samples))], chunk_size)
+        finally:
+            pool.close()
+            pool.join()
+            _sample_jobs_pipeline = None
+
+        # The jobs come back with copies of the samples: link them back to the pipeline samples
+        samples_by_name = dict([(sample.name, sample) for sample in self.samples])
+        jobs = []
+        for sample_job_list in sample_job_lists:
+            for job in sample_job_list:
+                job.samples = [samples_by_name[sample.name] for sample in job.samples]
+                jobs.append(job)
+        return jobs
+
+    def split_sequence_dictionary(self, nb_jobs):
+        """
+        Splits the sequence dictionary by size for a step scattered in nb_jobs jobs: the sequences
+        of each of the nb_jobs - 1 first jobs, and the sequences to exclude from the last 'others' job.
+        With [DEFAULT] scatter_balancing set to "cost", the jobs are balanced by cost instead (see balanced_split).
+
+        The split only depends on nb_jobs for a given sequence dictionary, so it is computed once
+        and shared by all the steps and samples using the same number of jobs.
+        Callers must not modify the returned lists.
+        """
+
+        if not hasattr(self, "_sequence_dictionary_splits"):
+            self._sequence_dictionary_splits = {}
+        if nb_jobs not in self._sequence_dictionary_splits:
+            if config.param('DEFAULT', 'scatter_balancing', required=False) == "cost":
+                self._sequence_dictionary_splits[nb_jobs] = self.balanced_split(nb_jobs)
+            else:
+                self._sequence_dictionary_splits[nb_jobs] = split_by_size(self.sequence_dictionary, nb_jobs - 1)
+        return self._sequence_dictionary_splits[nb_jobs]
+
+    def bed_coverage(self, bed_file):
+        """
+        Number of bases covered by the regions of a BED file, per sequence name.
+        Overlapping regions are merged so that no base is counted twice.
+        """
+
+        regions = {}
+        with open(bed_file) as bed:
+            for line in bed:
+                fields = line.split()
+                if len(fields) < 3 or fields[0] in ["track", "browser"] or fields[0].startswith("#"):
+                    continue
+                regions.setdefault(fields[0], []).append((int(fields[1]), int(fields[2])))
+
+        coverage = {}
+        for name, intervals in regions.items():
+            covered = 0
+            current_start, current_end = None, None
+            for start, end in sorted(intervals):
+                if current_end is None or start > current_end:
+                    if current_end is not None:
+                        covered += current_end - current_start
+                    current_start, current_end = start, end
+                else:
+                    current_end = max(current_end, end)
+            covered += current_end - current_start
+            coverage[name] = covered
+        return coverage
+
+    @property
+    def sequence_costs(self):
+        """
+        Estimated processing cost of each sequence of the dictionary, in dictionary order, used to balance
+        scatter jobs when [DEFAULT] scatter_balancing is set to "cost":
+
+        1. The sequence length, minus the gaps listed in the optional [DEFAULT] scatter_gaps_bed (e.g. N stretches)
+        2. Else if the first readset has a capture BED (see bvatools.resolve_readset_coverage_bed), only the captured bases are counted
+        3. Sequences listed in the optional [DEFAULT] scatter_runtimes file ("sequence<TAB>seconds" lines from previous runs)
+           cost their runtime instead; the others are converted to seconds at the average rate of the listed ones
+
+        A capture BED or a runtimes file naming none of the dictionary sequences (e.g. "1" vs "chr1") is ignored,
+        and the lengths are used if all costs end up being 0, since balancing on them would put every sequence in one job.
+        """
+
+        if not hasattr(self, "_sequence_costs"):
+            costs = [sequence['length'] for sequence in self.sequence_dictionary]
+
+            gaps_bed = config.param('DEFAULT', 'scatter_gaps_bed', required=False)
+            if gaps_bed:
+                gaps = self.bed_coverage(gaps_bed)
+                costs = [max(cost - gaps.get(sequence['name'], 0), 0) for sequence, cost in zip(self.sequence_dictionary, costs)]
+
+            coverage_bed = bvatools.resolve_readset_coverage_bed(self.samples[0].readsets[0])
+            if coverage_bed:
+                captured = self.bed_coverage(coverage_bed)
+                if any([sequence['name'] in captured for sequence in self.sequence_dictionary]):
+                    costs = [min(captured.get(sequence['name'], 0), cost) for sequence, cost in zip(self.sequence_dictionary, costs)]
+                else:
+                    log.warning("Capture BED " + coverage_bed + " has no region on the sequences of the dictionary: ignored for scatter balancing.")
+
+            runtimes_file = config.param('DEFAULT', 'scatter_runtimes', required=False)
+            if runtimes_file:
+                runtimes = {}
+                with open(runtimes_file) as runtimes_lines:
+                    for line in runtimes_lines:
+                        fields = line.split()
+                        if len(fields) == 2 and not fields[0].startswith("#"):
+                            runtimes[fields[0]] = float(fields[1])
+
+                # Seconds per unit of cost, from the sequences with a known runtime
+                known = [(cost, runtimes[sequence['name']]) for sequence, cost in zip(self.sequence_dictionary, costs) if sequence['name'] in runtimes]
+                known_cost = sum([cost for cost, runtime in known])
+                if known_cost:
+                    rate = sum([runtime for cost, runtime in known]) / known_cost
+                    costs = [runtimes.get(sequence['name'], cost * rate) for sequence, cost in zip(self.sequence_dictionary, costs)]
+                else:
+                    log.warning("Runtimes file " + runtimes_file + " has no usable runtime for the sequences of the dictionary: ignored for scatter balancing.")
+
+            if not sum(costs):
+                log.warning("All sequences have a cost of 0: scatter jobs are balanced by sequence length instead.")
+                costs = [sequence['length'] for sequence in self.sequence_dictionary]
+
+            self._sequence_costs = costs
+        return self._sequence_costs
+
+    def balanced_split(self, nb_jobs):
+        """
+        Splits the sequence dictionary into at most nb_jobs groups of consecutive sequences, minimizing
+        the cost of the most costly group (see sequence_costs), since the slowest job sets the wall-clock time.
+        Groups are kept consecutive so that merging the job outputs in job order keeps the dictionary order.
+
+        The smallest feasible maximum cost is found by binary search, each candidate being checked by
+        greedily filling the groups in dictionary order. Returns the same lists as split_by_size: the
+        sequences of each job but the last, and all these sequences, to exclude from the last 'others' job.
+        """
+
+        names = [sequence['name'] for sequence in self.sequence_dictionary]
+        # Integer costs, for an exact binary search on runtimes given in seconds
+        costs = [int(math.ceil(cost)) for cost in self.sequence_costs]
+
+        def greedy_groups(max_cost):
+            groups = [[]]
+            load = 0
+            for name, cost in zip(names, costs):
+                if groups[-1] and load + cost > max_cost:
+                    groups.append([])
+                    load = 0
+                groups[-1].append(name)
+                load += cost
+            return groups
+
+        low = max(costs) if costs else 0
+        high = sum(costs)
+        while low < high:
+            middle = (low + high) // 2
+            if len(greedy_groups(middle)) <= nb_jobs:
+                high = middle
+            else:
+                low = middle + 1
+
+        groups = greedy_groups(low)[:-1]
+        return groups, [name for group in groups for name in group]
+
     def bwa_mem_picard_sort_sam(self):
         """
         The filtered reads are aligned to a reference genome. The alignment is done per sequencing readset.
@@ -108,6 +296,7 @@ class DnaSeq(common.Illumina):
         """
 
         jobs = []
+        params = self.config_params('bwa_mem', ('sequencing_center', False, 'string'))
         for readset in self.readsets:
             trim_file_prefix = os.path.join("trim", readset.sample.name, readset.name + ".trim.")
             alignment_directory = os.path.join("alignment", readset.sample.name)
@@ -144,7 +333,7 @@ class DnaSeq(common.Illumina):
                             "\tSM:" + readset.sample.name + \
                             "\tLB:" + (readset.library if readset.library else readset.sample.name) + \
                             ("\tPU:run" + readset.run + "_" + readset.lane if readset.run and readset.lane else "") + \
-                            ("\tCN:" + config.param('bwa_mem', 'sequencing_center') if config.param('bwa_mem', 'sequencing_center', required=False) else "") + \
+                            ("\tCN:" + params.sequencing_center if params.sequencing_center else "") + \
                             "\tPL:Illumina" + \
                             "'"
                     ),
@@ -244,68 +433,78 @@ pandoc --to=markdown \\
         The reference genome is divided by a number regions given by the `nb_jobs` parameter.
         """
 
-        jobs = []
-
         nb_jobs = config.param('gatk_indel_realigner', 'nb_jobs', type='posint')
         if nb_jobs > 50:
             log.warning("Number of realign jobs is > 50. This is usually much. Anything beyond 20 can be problematic.")
+        if nb_jobs > 1:
+            # Split once before the samples are distributed, instead of once per process
+            self.split_sequence_dictionary(nb_jobs)
 
-        for sample in self.samples:
-            alignment_directory = os.path.join("alignment", sample.name)
-            realign_directory = os.path.join(alignment_directory, "realign")
-            input = os.path.join(alignment_directory, sample.name + ".sorted.bam")
+        return self.sample_jobs("gatk_indel_realigner_sample", nb_jobs)
 
-            if nb_jobs == 1:
-                realign_prefix = os.path.join(realign_directory, "all")
-                realign_intervals = realign_prefix + ".intervals"
-                output_bam = realign_prefix + ".bam"
-                sample_output_bam = os.path.join(alignment_directory, sample.name + ".realigned.qsorted.bam")
-                jobs.append(concat_jobs([
-                    Job(
-                        command="mkdir -p " + realign_directory,
-                        removable_files=[realign_directory],
-                        samples=[sample]
-                    ),
-                    gatk.realigner_target_creator(input, realign_intervals),
-                    gatk.indel_realigner(input, output=output_bam, target_intervals=realign_intervals),
-                    # Create sample realign symlink since no merging is required
-                    Job(
-                        [output_bam],
-                        [sample_output_bam],
-                        command="ln -s -f " + os.path.relpath(output_bam, os.path.dirname(sample_output_bam)) + " " + sample_output_bam
-                    )
-                ], name="gatk_indel_realigner." + sample.name))
+    def gatk_indel_realigner_sample(self, sample, nb_jobs):
+        """
+        GATK indel realignment jobs of a sample, see gatk_indel_realigner.
+        """
 
-            else:
-                # The first sequences are the longest to process.
-                # Each of them must be processed in a separate job.
-                unique_sequences_per_job,unique_sequences_per_job_others = split_by_size(self.sequence_dictionary, nb_jobs - 1)
+        jobs = []
 
-                # Create one separate job for each of the first sequences
-                for idx,sequence in enumerate(unique_sequences_per_job):
-                    realign_prefix = os.path.join(realign_directory, str(idx))
-                    realign_intervals = realign_prefix + ".intervals"
-                    intervals=sequence
-                    if str(idx) == 0:
-                        intervals.append("unmapped")
-                    output_bam = realign_prefix + ".bam"
-                    jobs.append(concat_jobs([
-                        # Create output directory since it is not done by default by GATK tools
-                        Job(command="mkdir -p " + realign_directory, removable_files=[realign_directory], samples=[sample]),
-                        gatk.realigner_target_creator(input, realign_intervals, intervals=intervals),
-                        gatk.indel_realigner(input, output=output_bam, target_intervals=realign_intervals, intervals=intervals)
-                    ], name="gatk_indel_realigner." + sample.name + "." + str(idx)))
+        alignment_directory = os.path.join("alignment", sample.name)
+        realign_directory = os.path.join(alignment_directory, "realign")
+        input = os.path.join(alignment_directory, sample.name + ".sorted.bam")
 
-                # Create one last job to process the last remaining sequences and 'others' sequences
-                realign_prefix = os.path.join(realign_directory, "others")
+        if nb_jobs == 1:
+            realign_prefix = os.path.join(realign_directory, "all")
+            realign_intervals = realign_prefix + ".intervals"
+            output_bam = realign_prefix + ".bam"
+            sample_output_bam = os.path.join(alignment_directory, sample.name + ".realigned.qsorted.bam")
+            jobs.append(concat_jobs([
+                Job(
+                    command="mkdir -p " + realign_directory,
+                    removable_files=[realign_directory],
+                    samples=[sample]
+                ),
+                gatk.realigner_target_creator(input, realign_intervals),
+                gatk.indel_realigner(input, output=output_bam, target_intervals=realign_intervals),
+                # Create sample realign symlink since no merging is required
+                Job(
+                    [output_bam],
+                    [sample_output_bam],
+                    command="ln -s -f " + os.path.relpath(output_bam, os.path.dirname(sample_output_bam)) + " " + sample_output_bam
+                )
+            ], name="gatk_indel_realigner." + sample.name))
+
+        else:
+            # The first sequences are the longest to process.
+            # Each of them must be processed in a separate job.
+            unique_sequences_per_job,unique_sequences_per_job_others = self.split_sequence_dictionary(nb_jobs)
+
+            # Create one separate job for each of the first sequences
+            for idx,sequence in enumerate(unique_sequences_per_job):
+                realign_prefix = os.path.join(realign_directory, str(idx))
                 realign_intervals = realign_prefix + ".intervals"
+                # Copy the shared split before extending it
+                intervals=list(sequence)
+                if str(idx) == 0:
+                    intervals.append("unmapped")
                 output_bam = realign_prefix + ".bam"
                 jobs.append(concat_jobs([
                     # Create output directory since it is not done by default by GATK tools
                     Job(command="mkdir -p " + realign_directory, removable_files=[realign_directory], samples=[sample]),
-                    gatk.realigner_target_creator(input, realign_intervals, exclude_intervals=unique_sequences_per_job_others),
-                    gatk.indel_realigner(input, output=output_bam, target_intervals=realign_intervals, exclude_intervals=unique_sequences_per_job_others)
-                ], name="gatk_indel_realigner." + sample.name + ".others"))
+                    gatk.realigner_target_creator(input, realign_intervals, intervals=intervals),
+                    gatk.indel_realigner(input, output=output_bam, target_intervals=realign_intervals, intervals=intervals)
+                ], name="gatk_indel_realigner." + sample.name + "." + str(idx)))
+
+            # Create one last job to process the last remaining sequences and 'others' sequences
+            realign_prefix = os.path.join(realign_directory, "others")
+            realign_intervals = realign_prefix + ".intervals"
+            output_bam = realign_prefix + ".bam"
+            jobs.append(concat_jobs([
+                # Create output directory since it is not done by default by GATK tools
+                Job(command="mkdir -p " + realign_directory, removable_files=[realign_directory], samples=[sample]),
+                gatk.realigner_target_creator(input, realign_intervals, exclude_intervals=unique_sequences_per_job_others),
+                gatk.indel_realigner(input, output=output_bam, target_intervals=realign_intervals, exclude_intervals=unique_sequences_per_job_others)
+            ], name="gatk_indel_realigner." + sample.name + ".others"))
 
         return jobs
 
@@ -325,7 +524,7 @@ pandoc --to=markdown \\
 
             # if nb_jobs == 1, symlink has been created in indel_realigner and merging is not necessary
             if nb_jobs > 1:
-                unique_sequences_per_job,unique_sequences_per_job_others = split_by_size(self.sequence_dictionary, nb_jobs - 1)
+                unique_sequences_per_job,unique_sequences_per_job_others = self.split_sequence_dictionary(nb_jobs)
 
                 inputBAMs = []
                 for idx,sequences in enumerate(unique_sequences_per_job):
@@ -518,6 +717,7 @@ cp \\
                 library[readset.sample]="PAIRED_END"
 
         jobs = []
+        params = self.config_params('bvatools_depth_of_coverage', ('other_options', False, 'string'))
         for sample in self.samples:
             recal_file_prefix = os.path.join("alignment", sample.name, sample.name + ".sorted.dup.recal.")
             input = recal_file_prefix + "bam"
@@ -538,7 +738,7 @@ cp \\
                 input,
                 recal_file_prefix + "coverage.tsv",
                 bvatools.resolve_readset_coverage_bed(sample.readsets[0]),
-                other_options=config.param('bvatools_depth_of_coverage', 'other_options', required=False)
+                other_options=params.other_options
             )
             job.samples = [sample]
             job.name = "bvatools_depth_of_coverage." + sample.name
@@ -601,11 +801,12 @@ cp \\
         """
 
         jobs = []
+        params = self.config_params('extract_common_snp_freq', ('common_snp_positions', True, 'filepath'))
 
         for sample in self.samples:
             alignment_file_prefix = os.path.join("alignment", sample.name, sample.name + ".")
 
-            job = bvatools.basefreq(alignment_file_prefix + "sorted.dup.recal.bam", alignment_file_prefix + "commonSNPs.alleleFreq.csv", config.param('extract_common_snp_freq', 'common_snp_positions', type='filepath'), 0)
+            job = bvatools.basefreq(alignment_file_prefix + "sorted.dup.recal.bam", alignment_file_prefix + "commonSNPs.alleleFreq.csv", params.common_snp_positions, 0)
             job.name = "extract_common_snp_freq." + sample.name
             job.samples = [sample]
             jobs.append(job)
@@ -618,11 +819,12 @@ cp \\
         """
 
         jobs = []
+        params = self.config_params('baf_plot', ('common_snp_positions', True, 'filepath'))
 
         for sample in self.samples:
             alignment_file_prefix = os.path.join("alignment", sample.name, sample.name + ".")
 
-            job = bvatools.ratiobaf(alignment_file_prefix + "commonSNPs.alleleFreq.csv", alignment_file_prefix + "ratioBAF", config.param('baf_plot', 'common_snp_positions', type='filepath'))
+            job = bvatools.ratiobaf(alignment_file_prefix + "commonSNPs.alleleFreq.csv", alignment_file_prefix + "ratioBAF", params.common_snp_positions)
             job.name = "baf_plot." + sample.name
             job.samples = [sample]
             jobs.append(job)
@@ -634,41 +836,50 @@ cp \\
         GATK haplotype caller for snps and small indels.
         """
 
-        jobs = []
-
         nb_haplotype_jobs = config.param('gatk_haplotype_caller', 'nb_jobs', type='posint')
         if nb_haplotype_jobs > 50:
             log.warning("Number of haplotype jobs is > 50. This is usually much. Anything beyond 20 can be problematic.")
+        if nb_haplotype_jobs > 1:
+            # Split once before the samples are distributed, instead of once per process
+            self.split_sequence_dictionary(nb_haplotype_jobs)
 
-        for sample in self.samples:
-            alignment_directory = os.path.join("alignment", sample.name)
-            haplotype_directory = os.path.join(alignment_directory, "rawHaplotypeCaller")
-            input = self.select_input_files(os.path.join(alignment_directory, sample.name + ".sorted.dup.recal.bam"),os.path.join(alignment_directory, sample.name + ".sorted.dup.bam"),os.path.join(alignment_directory, sample.name + ".sorted.bam"))
+        return self.sample_jobs("gatk_haplotype_caller_sample", nb_haplotype_jobs)
 
-            if nb_haplotype_jobs == 1:
-                jobs.append(concat_jobs([
-                    # Create output directory since it is not done by default by GATK tools
-                    Job(command="mkdir -p " + haplotype_directory,removable_files=[haplotype_directory], samples=[sample]),
-                    gatk.haplotype_caller(input, os.path.join(haplotype_directory, sample.name + ".hc.g.vcf.bgz"))
-                ], name="gatk_haplotype_caller." + sample.name))
+    def gatk_haplotype_caller_sample(self, sample, nb_haplotype_jobs):
+        """
+        GATK haplotype caller jobs of a sample, see gatk_haplotype_caller.
+        """
 
-            else:
-                unique_sequences_per_job,unique_sequences_per_job_others = split_by_size(self.sequence_dictionary, nb_haplotype_jobs - 1)
+        jobs = []
 
-                # Create one separate job for each of the first sequences
-                for idx,sequences in enumerate(unique_sequences_per_job):
-                    jobs.append(concat_jobs([
-                        # Create output directory since it is not done by default by GATK tools
-                        Job(command="mkdir -p " + haplotype_directory,removable_files=[haplotype_directory], samples=[sample]),
-                        gatk.haplotype_caller(input, os.path.join(haplotype_directory, sample.name + "." + str(idx) + ".hc.g.vcf.bgz"), intervals=sequences)
-                    ], name="gatk_haplotype_caller." + sample.name + "." + str(idx)))
+        alignment_directory = os.path.join("alignment", sample.name)
+        haplotype_directory = os.path.join(alignment_directory, "rawHaplotypeCaller")
+        input = self.select_input_files(os.path.join(alignment_directory, sample.name + ".sorted.dup.recal.bam"),os.path.join(alignment_directory, sample.name + ".sorted.dup.bam"),os.path.join(alignment_directory, sample.name + ".sorted.bam"))
 
-                # Create one last job to process the last remaining sequences and 'others' sequences
+        if nb_haplotype_jobs == 1:
+            jobs.append(concat_jobs([
+                # Create output directory since it is not done by default by GATK tools
+                Job(command="mkdir -p " + haplotype_directory,removable_files=[haplotype_directory], samples=[sample]),
+                gatk.haplotype_caller(input, os.path.join(haplotype_directory, sample.name + ".hc.g.vcf.bgz"))
+            ], name="gatk_haplotype_caller." + sample.name))
+
+        else:
+            unique_sequences_per_job,unique_sequences_per_job_others = self.split_sequence_dictionary(nb_haplotype_jobs)
+
+            # Create one separate job for each of the first sequences
+            for idx,sequences in enumerate(unique_sequences_per_job):
                 jobs.append(concat_jobs([
                     # Create output directory since it is not done by default by GATK tools
                     Job(command="mkdir -p " + haplotype_directory,removable_files=[haplotype_directory], samples=[sample]),
-                    gatk.haplotype_caller(input, os.path.join(haplotype_directory, sample.name + ".others.hc.g.vcf.bgz"), exclude_intervals=unique_sequences_per_job_others)
-                ], name="gatk_haplotype_caller." + sample.name + ".others"))
+                    gatk.haplotype_caller(input, os.path.join(haplotype_directory, sample.name + "." + str(idx) + ".hc.g.vcf.bgz"), intervals=sequences)
+                ], name="gatk_haplotype_caller." + sample.name + "." + str(idx)))
+
+            # Create one last job to process the last remaining sequences and 'others' sequences
+            jobs.append(concat_jobs([
+                # Create output directory since it is not done by default by GATK tools
+                Job(command="mkdir -p " + haplotype_directory,removable_files=[haplotype_directory], samples=[sample]),
+                gatk.haplotype_caller(input, os.path.join(haplotype_directory, sample.name + ".others.hc.g.vcf.bgz"), exclude_intervals=unique_sequences_per_job_others)
+            ], name="gatk_haplotype_caller." + sample.name + ".others"))
 
         return jobs
 
@@ -679,6 +890,7 @@ cp \\
 
         jobs = []
         nb_haplotype_jobs = config.param('gatk_haplotype_caller', 'nb_jobs', type='posint')
+        params = self.config_params('gatk_merge_and_call_individual_gvcfs', 'options')
 
         for sample in self.samples:
             haplotype_file_prefix = os.path.join("alignment", sample.name, "rawHaplotypeCaller", sample.name)
@@ -686,7 +898,7 @@ cp \\
             if nb_haplotype_jobs == 1:
                 gvcfs_to_merge = [haplotype_file_prefix + ".hc.g.vcf.bgz"]
             else:
-                unique_sequences_per_job,unique_sequences_per_job_others = split_by_size(self.sequence_dictionary, nb_haplotype_jobs - 1)
+                unique_sequences_per_job,unique_sequences_per_job_others = self.split_sequence_dictionary(nb_haplotype_jobs)
 
                 gvcfs_to_merge = [haplotype_file_prefix + "." + str(idx) + ".hc.g.vcf.bgz" for idx in xrange(len(unique_sequences_per_job))]
                 gvcfs_to_merge.append(haplotype_file_prefix + ".others.hc.g.vcf.bgz")
@@ -694,7 +906,7 @@ cp \\
             jobs.append(concat_jobs([
                 Job(samples=[sample]),
                 gatk.cat_variants(gvcfs_to_merge, output_haplotype_file_prefix + ".hc.g.vcf.bgz"),
-                gatk.genotype_gvcf([output_haplotype_file_prefix + ".hc.g.vcf.bgz"], output_haplotype_file_prefix + ".hc.vcf.bgz",config.param('gatk_merge_and_call_individual_gvcfs', 'options'))
+                gatk.genotype_gvcf([output_haplotype_file_prefix + ".hc.g.vcf.bgz"], output_haplotype_file_prefix + ".hc.vcf.bgz",params.options)
             ], name="merge_and_call_individual_gvcf." + sample.name))
 
         return jobs
@@ -715,7 +927,7 @@ cp \\
                     gatk.combine_gvcf([ os.path.join("alignment", sample.name, sample.name)+".hc.g.vcf.bgz" for sample in self.samples ], os.path.join("variants", "allSamples.hc.g.vcf.bgz"))],
                     name="gatk_combine_gvcf.AllSamples", samples=self.samples))
             else :
-                unique_sequences_per_job,unique_sequences_per_job_others = split_by_size(self.sequence_dictionary, nb_haplotype_jobs - 1)
+                unique_sequences_per_job,unique_sequences_per_job_others = self.split_sequence_dictionary(nb_haplotype_jobs)
 
                 # Create one separate job for each of the first sequences
                 for idx,sequences in enumerate(unique_sequences_per_job):
@@ -742,7 +954,7 @@ cp \\
                         gatk.combine_gvcf([ os.path.join("alignment", sample.name, sample.name)+".hc.g.vcf.bgz" for sample in batch ], os.path.join("variants", "allSamples.batch" + str(cpt) + ".hc.g.vcf.bgz"))
                     ], name="gatk_combine_gvcf.AllSamples.batch" + str(cpt)))
                 else :
-                    unique_sequences_per_job,unique_sequences_per_job_others = split_by_size(self.sequence_dictionary, nb_haplotype_jobs - 1)
+                    unique_sequences_per_job,unique_sequences_per_job_others = self.split_sequence_dictionary(nb_haplotype_jobs)
 
                     # Create one separate job for each of the first sequences
                     for idx,sequences in enumerate(unique_sequences_per_job):
@@ -767,7 +979,7 @@ cp \\
                 job.samples = self.samples
                 jobs.append(job)
             else :
-                unique_sequences_per_job,unique_sequences_per_job_others = split_by_size(self.sequence_dictionary, nb_haplotype_jobs - 1)
+                unique_sequences_per_job,unique_sequences_per_job_others = self.split_sequence_dictionary(nb_haplotype_jobs)
 
                 # Create one separate job for each of the first sequences
                 for idx,sequences in enumerate(unique_sequences_per_job):
@@ -798,7 +1010,7 @@ cp \\
         output_haplotype = os.path.join("variants", "allSamples.hc.g.vcf.bgz")
         output_haplotype_genotyped = os.path.join("variants", "allSamples.hc.vcf.bgz")
         if nb_haplotype_jobs > 1:
-            unique_sequences_per_job,unique_sequences_per_job_others = split_by_size(self.sequence_dictionary, nb_haplotype_jobs - 1)
+            unique_sequences_per_job,unique_sequences_per_job_others = self.split_sequence_dictionary(nb_haplotype_jobs)
 
             gvcfs_to_merge = [haplotype_file_prefix + "." + str(idx) + ".hc.g.vcf.bgz" for idx in xrange(len(unique_sequences_per_job))]
             gvcfs_to_merge.append(haplotype_file_prefix + ".others.hc.g.vcf.bgz")
@@ -920,17 +1132,62 @@ pandoc \\
         return [job]
 
     def generate_approximate_windows(self, nb_jobs):
+        """
+        Lazily yields the windows of the genome for about nb_jobs scatter jobs, as (name, regions) pairs,
+        regions being (sequence name, start, end) triplets, 1-based and inclusive.
+
+        With more jobs than sequences, each sequence is split into windows of about the same size, one
+        region per window named "sequence:start-end". Otherwise, consecutive sequences are grouped into at
+        most nb_jobs shards of about the same size, so that fragmented assemblies do not get one job per
+        scaffold: a shard of a single sequence is named "sequence:1-length", the others "shard" + index.
+        With [DEFAULT] scatter_balancing set to "cost", sizes are measured by sequence_costs instead of lengths.
+        """
+
+        balanced = config.param('DEFAULT', 'scatter_balancing', required=False) == "cost"
+
         if nb_jobs <= len(self.sequence_dictionary):
-            return [sequence['name'] + ":1-" + str(sequence['length']) for sequence in self.sequence_dictionary]
+            weights = self.sequence_costs if balanced else [sequence['length'] for sequence in self.sequence_dictionary]
+            shard_weight = sum(weights) / float(nb_jobs)
+
+            # Close a shard whenever the cumulated weight reaches its share, hence at most nb_jobs shards
+            shard = []
+            nb_shards = 0
+            cumulated_weight = 0
+            for sequence, weight in zip(self.sequence_dictionary, weights):
+                shard.append((sequence['name'], 1, sequence['length']))
+                cumulated_weight += weight
+                if cumulated_weight >= (nb_shards + 1) * shard_weight and nb_shards < nb_jobs - 1:
+                    yield self.window_name(shard, nb_shards), shard
+                    shard = []
+                    nb_shards += 1
+            if shard:
+                yield self.window_name(shard, nb_shards), shard
         else:
             total_length = sum([sequence['length'] for sequence in self.sequence_dictionary])
             approximate_window_size = int(math.floor(total_length / (nb_jobs - len(self.sequence_dictionary))))
-            windows = []
 
-            for sequence in self.sequence_dictionary:
-                for start, end in [[pos, min(pos + approximate_window_size - 1, sequence['length'])] for pos in range(1, sequence['length'] + 1, approximate_window_size)]:
-                    windows.append(sequence['name'] + ":" + str(start) + "-" + str(end))
-            return windows
+            # Balanced by cost, the windows of each sequence span the same cost instead of the same length
+            if balanced:
+                approximate_window_cost = sum(self.sequence_costs) / float(nb_jobs - len(self.sequence_dictionary))
+
+            for index, sequence in enumerate(self.sequence_dictionary):
+                window_size = approximate_window_size
+                if balanced:
+                    cost = self.sequence_costs[index]
+                    window_size = max(int(math.floor(approximate_window_cost * sequence['length'] / cost)), 1) if cost else sequence['length']
+                for start in xrange(1, sequence['length'] + 1, window_size):
+                    end = min(start + window_size - 1, sequence['length'])
+                    yield sequence['name'] + ":" + str(start) + "-" + str(end), [(sequence['name'], start, end)]
+
+    def window_name(self, regions, index):
+        """
+        Name of a window of generate_approximate_windows, used in its job and output file names.
+        """
+
+        if len(regions) == 1:
+            return regions[0][0] + ":" + str(regions[0][1]) + "-" + str(regions[0][2])
+        else:
+            return "shard" + str(index)
 
     def rawmpileup(self):
         """
@@ -939,6 +1196,7 @@ pandoc \\
         """
 
         jobs = []
+        params = self.config_params('rawmpileup', 'mpileup_other_options')
         for sample in self.samples:
             mpileup_directory = os.path.join("alignment", sample.name, "mpileup")
 
@@ -947,7 +1205,7 @@ pandoc \\
                 jobs.append(concat_jobs([
                     Job(command="mkdir -p " + mpileup_directory),
                     pipe_jobs([
-                        samtools.mpileup([os.path.join("alignment", sample.name, sample.name + ".sorted.dup.recal.bam")], None, config.param('rawmpileup', 'mpileup_other_options'), sequence['name']),
+                        samtools.mpileup([os.path.join("alignment", sample.name, sample.name + ".sorted.dup.recal.bam")], None, params.mpileup_other_options, sequence['name']),
                         Job(output_files=[output], command="gzip -1 -c > " + output, samples=[sample])
                     ])], name="rawmpileup." + sample.name + "." + sequence['name']))
 
@@ -980,24 +1238,44 @@ pandoc \\
         jobs = []
         input_bams = [os.path.join("alignment", sample.name, sample.name + ".sorted.dup.recal.bam") for sample in self.samples]
         nb_jobs = config.param('snp_and_indel_bcf', 'approximate_nb_jobs', type='posint')
+        params = self.config_params('snp_and_indel_bcf', 'mpileup_other_options', 'bcftools_other_options')
         output_directory = "variants/rawBCF"
 
         if nb_jobs == 1:
             jobs.append(concat_jobs([
                 Job(command="mkdir -p " + output_directory, samples=self.samples),
                 pipe_jobs([
-                    samtools.mpileup(input_bams, None, config.param('snp_and_indel_bcf', 'mpileup_other_options')),
-                    samtools.bcftools_call("-", os.path.join(output_directory, "allSamples.bcf"), config.param('snp_and_indel_bcf', 'bcftools_other_options')),
+                    samtools.mpileup(input_bams, None, params.mpileup_other_options),
+                    samtools.bcftools_call("-", os.path.join(output_directory, "allSamples.bcf"), params.bcftools_other_options),
                 ])], name="snp_and_indel_bcf.allSamples"))
 
         else:
-            for region in self.generate_approximate_windows(nb_jobs):
-                jobs.append(concat_jobs([
-                    Job(command="mkdir -p " + output_directory, samples=self.samples),
-                    pipe_jobs([
-                        samtools.mpileup(input_bams, None, config.param('snp_and_indel_bcf', 'mpileup_other_options'), region),
-                        samtools.bcftools_call("-", os.path.join(output_directory, "allSamples." + region + ".bcf"), config.param('snp_and_indel_bcf', 'bcftools_other_options')),
-                    ])], name="snp_and_indel_bcf.allSamples." + re.sub(":", "_", region)))
+            for window, regions in self.generate_approximate_windows(nb_jobs):
+                output = os.path.join(output_directory, "allSamples." + window + ".bcf")
+
+                if len(regions) == 1:
+                    jobs.append(concat_jobs([
+                        Job(command="mkdir -p " + output_directory, samples=self.samples),
+                        pipe_jobs([
+                            samtools.mpileup(input_bams, None, params.mpileup_other_options, window),
+                            samtools.bcftools_call("-", output, params.bcftools_other_options),
+                        ])], name="snp_and_indel_bcf.allSamples." + re.sub(":", "_", window)))
+
+                else:
+                    # Each sequence of a shard is called on its own indexed region, so that the BAMs are
+                    # read through their index rather than whole, and the calls are concatenated in dictionary order
+                    region_outputs = [os.path.join(output_directory, "allSamples." + window + "." + str(idx) + ".bcf") for idx in xrange(len(regions))]
+                    region_jobs = [
+                        pipe_jobs([
+                            samtools.mpileup(input_bams, None, params.mpileup_other_options, name + ":" + str(start) + "-" + str(end)),
+                            samtools.bcftools_call("-", region_output, params.bcftools_other_options),
+                        ]) for (name, start, end), region_output in zip(regions, region_outputs)]
+
+                    jobs.append(concat_jobs([
+                        Job(command="mkdir -p " + output_directory, removable_files=region_outputs, samples=self.samples)
+                    ] + region_jobs + [
+                        samtools.bcftools_cat(region_outputs, output)
+                    ], name="snp_and_indel_bcf.allSamples." + window))
 
         return jobs
 
@@ -1015,7 +1293,7 @@ pandoc \\
         if nb_jobs == 1:
             inputs = ["variants/rawBCF/allSamples.bcf"]
         else:
-            inputs = ["variants/rawBCF/allSamples." + region + ".bcf" for region in self.generate_approximate_windows(nb_jobs)]
+            inputs = ["variants/rawBCF/allSamples." + window + ".bcf" for window, regions in self.generate_approximate_windows(nb_jobs)]
         output_file_prefix = "variants/allSamples.merged."
 
         bcf = output_file_prefix + "bcf"
@@ -24,405 +24,2775 @@
 
 # Python Standard Modules
 import argparse
+import array
+import collections
+import collections.abc
+import concurrent.futures
+import contextlib
+import gzip
+import hashlib
+import io
+import json
+import marshal
+import mmap
 import os
 import re
+import struct
 import sys
+import tempfile
 
-# Import Graphviz
-from graphviz import Digraph
+# Graphviz is imported by import_graphviz, only when an image is rendered
 
+# connectors relating the predecessors of a node in the hierarchy file
+ANY_OF = ","
+ALL_OF = "+"
 
-class FlowChart():
+# external data that can act as the top nodes of a flowchart
+SOURCES = ("BAM", "FASTQ")
+
+# directory where parsed hierarchy files are cached between invocations
+CACHE_DIR = os.path.join(os.environ.get("XDG_CACHE_HOME") or
+                         os.path.join(os.path.expanduser("~"), ".cache"),
+                         "genpipes_flowchart")
+
+# bumped whenever the layout of the cached hierarchies, or the checks of the
+# hierarchy files, change
+CACHE_VERSION = 4
+
+# attributes set by parse_hierarchy, in the order they are cached
+HIERARCHY_ATTRIBUTES = ("links", "name_list", "max_step", "node_ids",
+                        "node_labels", "predecessors", "successors")
+
+# first bytes of gzip-compressed hierarchy files
+GZIP_MAGIC = b"\x1f\x8b"
+
+# layout of compiled hierarchy files (see BinaryHierarchy): header, number
+# of integers per node record, and connector codes of the node records
+BINARY_MAGIC = b"GPFLOW01"
+BINARY_MARK = 0x01020304
+BINARY_HEADER = struct.Struct("=8s6I")
+NODE_FIELDS = 9
+BINARY_CONNECTORS = (None, ANY_OF, ALL_OF)
+
+# directory where the flowcharts are saved
+OUTPUT_DIR = "flowcharts/"
+
+# formats a flowchart can be returned in without writing any file
+PIPE_FORMATS = ("dot", "svg", "png", "pdf")
+
+# message shown when the Graphviz dot executable is not installed
+DOT_NOT_FOUND = "the Graphviz dot executable is needed to render " + \
+    "flowcharts, see https://graphviz.org/download/"
+
+# combinations of BAM and FASTQ data a READSET can have
+DATA_COMBINATIONS = ((True, True), (True, False), (False, True),
+                     (False, False))
+
+# DOT identifiers which can be written without quotes: names and numerals
+DOT_ID = re.compile(r"([a-zA-Z_][a-zA-Z0-9_]*|"
+                    r"-?(\.[0-9]+|[0-9]+(\.[0-9]*)?))$")
+DOT_KEYWORDS = ("node", "edge", "graph", "digraph", "subgraph", "strict")
+
+# step numbers, in ASCII digits only: str.isdigit also accepts digits such
+# as "\u00b2" which int() rejects
+STEP_NUMBER = re.compile(r"[0-9]+$")
+
+# predecessors of a node, compiled from a predecessor term of the hierarchy
+# file: the connector relating them and the tuple of their node ids
+PredecessorGroup = collections.namedtuple("PredecessorGroup",
+                                          ["connector", "members"])
+
+
+class FlowChartError(Exception):
     """
-    This FlowChart class helps create user-friendly flow charts when a
-    pipeline is executed (either in its entirety or partially). This script
-    needs the user to select steps that are linked to each other; in other
-    words, a step can not be executed unless its predecessor is executed.
+    Raised when the steps or the hierarchy file given to FlowChart are
+    incorrect. The message is meant to be shown to the user as is.
+    """
+
+
+def import_graphviz():
+    """
+    This function imports the graphviz package. It is only needed to render
+    images, writing the DOT source of a flowchart does not import it.
+
+    Parameters
+    ----------
+
+    Returns
+    ----------
+    module
+        The graphviz package
+    """
+
+    try:
+        import graphviz
+    except ImportError:
+        raise FlowChartError("the graphviz package is needed to render " +
+                             "flowcharts: pip install graphviz")
+
+    return graphviz
+
+
+def import_numpy():
+    """
+    This function imports the numpy package. It is only needed to check
+    many selections of steps at once, see FlowChart.check_selections.
+
+    Parameters
+    ----------
+
+    Returns
+    ----------
+    module
+        The numpy package
+    """
+
+    try:
+        import numpy
+    except ImportError:
+        raise FlowChartError("the numpy package is needed to check many " +
+                             "selections at once: pip install numpy")
+
+    return numpy
+
+
+def quote(identifier):
+    """
+    This function writes a string as a DOT identifier, quoting it the same
+    way the graphviz package does.
+
+    Example:
+
+    "BAM" stays BAM
+    "1:picard_sam_to_fastq" becomes "\"1:picard_sam_to_fastq\""
+
+    Parameters
+    ----------
+    identifier: string
+        Node name or attribute value
+
+    Returns
+    ----------
+    string
+        DOT identifier
+    """
+
+    if DOT_ID.match(identifier) and identifier.lower() not in DOT_KEYWORDS:
+        return identifier
+
+    return "\"" + identifier.replace("\"", "\\\"") + "\""
+
+
+def format_steps(steps):
+    """
+    This function describes a list of steps the way they are given to
+    --steps, the reverse of FlowChart.parse_steps.
+
+    Example:
+
+    ["1", "2", "3", "4", "7"] becomes "1-4,7"
+
+    Parameters
+    ----------
+    steps: list
+        List of step numbers, as strings or integers
+
+    Returns
+    ----------
+    string
+        String describing the steps
+    """
+
+    return str(StepSet((int(step), int(step)) for step in steps))
+
+
+def str2bool(v):
+    """
+    This function accepts and converts the values of --bam and --fastq, and
+    of the BAM and FASTQ columns of batch files.
+
+    Parameters
+    ----------
+    v: string
+        Yes/no value
+
+    Returns
+    ----------
+    boolean
+        Value of v
+    """
+
+    if v.lower() in ("yes", "true", "t", "y", "1"):
+        return True
+    elif v.lower() in ("no", "false", "f", "n", "0"):
+        return False
+    else:
+        raise argparse.ArgumentTypeError("Boolean value expected.")
+
+
+def read_batch(batch_file):
+    """
+    This function reads the flowcharts requested in a batch file. Each line
+    holds the steps of one flowchart, optionally followed by whether BAM and
+    FASTQ data are present (both default to yes). Lines beginning with a
+    hash (#) and blank lines are ignored. A malformed line is kept as an
+    entry holding its error, so that it fails without ending the batch.
+
+    Example:
+
+    1-29
+    5-8,17-20    yes    no
+
+    Parameters
+    ----------
+    batch_file: file
+        Open batch file
+
+    Returns
+    ----------
+    list
+        List of (steps, if_bam, if_fastq, error) tuples, error being None
+        for a well-formed line
+    """
+
+    entries = []
+    for line_number, line in enumerate(batch_file, 1):
+        splitted = line.split()
+
+        # ignoring commented and blank lines
+        if not splitted or splitted[0][0] == "#":
+            continue
+
+        error = None
+        try:
+            if len(splitted) > 3:
+                raise argparse.ArgumentTypeError("Too many columns.")
+            values = [str2bool(v) for v in splitted[1:]] + [True, True]
+        except argparse.ArgumentTypeError as inst:
+            error = "line " + str(line_number) + " of the batch file: " + \
+                str(inst)
+            values = [True, True]
+
+        entries.append((splitted[0].replace("'", ""), values[0], values[1],
+                        error))
+
+    return entries
+
+
+@contextlib.contextmanager
+def open_hierarchy(hierarchy_file_name):
+    """
+    This function opens a hierarchy file for reading as text, "-" standing
+    for the standard input. Gzip-compressed hierarchies are recognised by
+    their first bytes, whatever their name, and decompressed on the fly.
+
+    Parameters
+    ----------
+    hierarchy_file_name: path
+        Name of the hierarchy file, "-" for stdin
+
+    Returns
+    ----------
+    file
+        Hierarchy file, open in text mode
+    """
+
+    if hierarchy_file_name == "-":
+        raw = sys.stdin.buffer
+    else:
+        raw = open(hierarchy_file_name, "rb")
+
+    try:
+        stream = raw
+        if raw.peek(len(GZIP_MAGIC))[:len(GZIP_MAGIC)] == GZIP_MAGIC:
+            stream = gzip.GzipFile(fileobj=raw)
+
+        text = io.TextIOWrapper(stream)
+        try:
+            yield text
+        finally:
+            # leave the standard input open for the rest of the program
+            text.detach()
+            if stream is not raw:
+                stream.close()
+    finally:
+        if raw is not sys.stdin.buffer:
+            raw.close()
+
+
+def read_hierarchy(hierarchy_file, file_name):
+    """
+    This function reads the rows of a hierarchy file one at a time, checking
+    each of them as it goes. Lines beginning with a hash (#) and blank lines
+    are ignored. Errors are raised as FlowChartError, prefixed with the file
+    name and line number. Steps are numbered 1, 2, 3... in the order of the
+    file, without gaps, so that step numbers index the steps.
+
+    Predecessors may be defined further down the file, so the references to
+    steps that are never defined are only reported at its end. Cycles are
+    left to FlowChart.parse_hierarchy.
+
+    Parameters
+    ----------
+    hierarchy_file: file
+        Open hierarchy file
+    file_name: string
+        Name of the hierarchy file, used in the error messages
+
+    Returns
+    ----------
+    generator
+        (line number, predecessor term, step number, step name) tuples
+    """
+
+    # line numbers of the steps defined so far, and of the first reference
+    # to each step not defined yet
+    defined = dict()
+    undefined = collections.OrderedDict()
+
+    for line_number, line in enumerate(hierarchy_file, 1):
+        splitted = line.split()
+
+        # ignoring commented and blank lines
+        if not splitted or splitted[0][0] == "#":
+            continue
+
+        where = file_name + ":" + str(line_number) + ": "
+
+        if len(splitted) < 2 or ":" not in splitted[1]:
+            raise FlowChartError(where + "expected \"PREDECESSORS\\t" +
+                                 "STEP:NAME\", found \"" + line.strip() +
+                                 "\".")
+
+        predecessor_term = splitted[0]
+        step_number, _, step_name = splitted[1].partition(":")
+
+        if not STEP_NUMBER.match(step_number):
+            raise FlowChartError(where + "step number \"" + step_number +
+                                 "\" is not a positive integer.")
+        if step_number in defined:
+            raise FlowChartError(where + "step " + step_number + " is " +
+                                 "already defined on line " +
+                                 str(defined[step_number]) + ".")
+        if step_number != str(len(defined) + 1):
+            raise FlowChartError(where + "expected step " +
+                                 str(len(defined) + 1) + ", found step " +
+                                 step_number + ": steps are numbered 1, " +
+                                 "2, 3... in the order of the file.")
+        if ANY_OF in predecessor_term and ALL_OF in predecessor_term:
+            raise FlowChartError(where + "predecessor term \"" +
+                                 predecessor_term + "\" mixes \",\" and " +
+                                 "\"+\" connectors.")
+
+        connector = ALL_OF if ALL_OF in predecessor_term else ANY_OF
+        for item in predecessor_term.split(connector):
+            if not item:
+                raise FlowChartError(where + "predecessor term \"" +
+                                     predecessor_term + "\" has an empty " +
+                                     "predecessor.")
+            if item not in SOURCES and item not in defined:
+                undefined.setdefault(item, line_number)
+
+        defined[step_number] = line_number
+        undefined.pop(step_number, None)
+
+        yield line_number, predecessor_term, step_number, step_name
+
+    for item, line_number in undefined.items():
+        raise FlowChartError(file_name + ":" + str(line_number) + ": " +
+                             "predecessor \"" + item + "\" is not a step " +
+                             "of the hierarchy file.")
+
+
+class SequenceView(collections.abc.Sequence):
+    """
+    This SequenceView class is a read-only list whose items are computed on
+    access, so that a compiled hierarchy stands in for the lists of a parsed
+    one without being unpacked into Python objects.
+    """
+
+    def __init__(self, length, item):
+        """
+        Parameters
+        ----------
+        length: int
+            Number of items
+        item: function
+            Function returning the item at an index
+        """
+
+        self.length = length
+        self.item = item
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.item(i) for i in range(*index.indices(self.length))]
+        if index < 0:
+            index += self.length
+        if not 0 <= index < self.length:
+            raise IndexError("sequence index out of range")
+        return self.item(index)
+
+
+class NodeIdsView(collections.abc.Mapping):
+    """
+    This NodeIdsView class is the read-only dictionary of node ids of a
+    compiled hierarchy, keyed by data source or step number. Keys are looked
+    up by binary search in the sorted label index of the file.
+    """
+
+    def __init__(self, binary):
+        """
+        Parameters
+        ----------
+        binary: BinaryHierarchy
+            Compiled hierarchy
+        """
+
+        self.binary = binary
+
+    def __len__(self):
+        return self.binary.nb_nodes
+
+    def __iter__(self):
+        return (self.binary.label(node)
+                for node in range(self.binary.nb_nodes))
+
+    def __getitem__(self, label):
+        node = self.binary.find(label)
+        if node is None:
+            raise KeyError(label)
+        return node
+
+
+class LinksView(collections.abc.Mapping):
+    """
+    This LinksView class is the read-only dictionary of predecessor terms of
+    a compiled hierarchy, keyed by step number. Terms are written back from
+    the predecessor groups on access.
+    """
+
+    def __init__(self, binary):
+        """
+        Parameters
+        ----------
+        binary: BinaryHierarchy
+            Compiled hierarchy
+        """
+
+        self.binary = binary
+
+    def __len__(self):
+        return self.binary.nb_nodes - len(SOURCES)
+
+    def __iter__(self):
+        return (self.binary.label(node)
+                for node in range(len(SOURCES), self.binary.nb_nodes))
+
+    def __getitem__(self, step):
+        node = self.binary.find(step)
+        if node is None or node < len(SOURCES):
+            raise KeyError(step)
+        group = self.binary.group(node)
+        return group.connector.join(self.binary.label(member)
+                                    for member in group.members)
+
+
+class BinaryHierarchy():
+    """
+    This BinaryHierarchy class reads a compiled hierarchy file in place,
+    through a read-only memory map. The file holds, in native byte order:
+
+    - a header: BINARY_MAGIC, a byte order mark and the number of nodes,
+    predecessors, successors, the final step and the size of the strings
+
+    - one fixed-width record of NODE_FIELDS integers per node id: offset and
+    length of its label and step name in the strings, connector code, and
+    start and count of its predecessors and successors
+
+    - the predecessors, then the successors, of all the nodes one after the
+    other (compressed sparse rows indexed by the node records)
+
+    - the node ids sorted by label, to look labels up by binary search
+
+    - the strings, encoded in UTF-8
+    """
+
+    def __init__(self, file_name):
+        """
+        Parameters
+        ----------
+        file_name: path
+            Name of the compiled hierarchy file
+
+        Modifies
+        ----------
+        self.nb_nodes: int
+            Number of nodes, data sources included
+        self.max_step: int
+            Stores the id of the final step in the pipeline
+        """
+
+        with open(file_name, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if len(self.map) < BINARY_HEADER.size:
+            raise FlowChartError(file_name + " is truncated.")
+        magic, mark, self.nb_nodes, nb_predecessors, nb_successors, \
+            self.max_step, strings_size = BINARY_HEADER.unpack_from(self.map)
+        if magic != BINARY_MAGIC:
+            raise FlowChartError(file_name + " is not a compiled hierarchy " +
+                                 "file.")
+        if mark != BINARY_MARK:
+            raise FlowChartError(file_name + " was compiled on a machine " +
+                                 "of another byte order, compile it again.")
+
+        # integer sections, in file order, then the strings
+        sizes = (self.nb_nodes * NODE_FIELDS, nb_predecessors, nb_successors,
+                 self.nb_nodes)
+        end = BINARY_HEADER.size + 4 * sum(sizes)
+        if len(self.map) != end + strings_size:
+            raise FlowChartError(file_name + " is truncated.")
+
+        view = memoryview(self.map)
+        sections = []
+        start = BINARY_HEADER.size
+        for size in sizes:
+            sections.append(view[start:start + 4 * size].cast("I"))
+            start += 4 * size
+        self.records, self.predecessors, self.successors, self.sorted_ids = \
+            sections
+        self.strings = view[end:]
+
+    def string(self, offset, length):
+        """
+        This function decodes a string of the string table.
+
+        Parameters
+        ----------
+        offset: int
+            Offset of the string in the string table
+        length: int
+            Length of the encoded string
+
+        Returns
+        ----------
+        string
+            Decoded string
+        """
+
+        return str(self.strings[offset:offset + length], "utf-8")
+
+    def label(self, node):
+        """
+        This function reads the data source or step number of a node.
+
+        Parameters
+        ----------
+        node: int
+            Node id
+
+        Returns
+        ----------
+        string
+            Label of the node
+        """
+
+        record = node * NODE_FIELDS
+        return self.string(self.records[record], self.records[record + 1])
+
+    def name(self, node):
+        """
+        This function reads the step name of a node.
+
+        Parameters
+        ----------
+        node: int
+            Node id
+
+        Returns
+        ----------
+        string
+            Name of the step, empty for the data sources
+        """
+
+        record = node * NODE_FIELDS
+        return self.string(self.records[record + 2],
+                           self.records[record + 3])
+
+    def group(self, node):
+        """
+        This function reads the predecessor group of a node.
+
+        Parameters
+        ----------
+        node: int
+            Node id
+
+        Returns
+        ----------
+        PredecessorGroup
+            Connector and node ids of the predecessors, None for the data
+            sources
+        """
+
+        record = node * NODE_FIELDS
+        connector = BINARY_CONNECTORS[self.records[record + 4]]
+        if connector is None:
+            return None
+        start = self.records[record + 5]
+        return PredecessorGroup(connector, tuple(
+            self.predecessors[start:start + self.records[record + 6]]))
+
+    def successors_of(self, node):
+        """
+        This function reads the successors of a node.
+
+        Parameters
+        ----------
+        node: int
+            Node id
+
+        Returns
+        ----------
+        tuple
+            Node ids having the node among their predecessors
+        """
+
+        record = node * NODE_FIELDS
+        start = self.records[record + 7]
+        return tuple(self.successors[start:start + self.records[record + 8]])
+
+    def find(self, label):
+        """
+        This function looks a label up in the sorted label index.
+
+        Parameters
+        ----------
+        label: string
+            Data source or step number
+
+        Returns
+        ----------
+        int
+            Node id of the label, None if it is not in the hierarchy
+        """
+
+        if not isinstance(label, str):
+            return None
+        key = label.encode("utf-8")
+
+        low = 0
+        high = self.nb_nodes
+        while low < high:
+            middle = (low + high) // 2
+            record = self.sorted_ids[middle] * NODE_FIELDS
+            offset = self.records[record]
+            found = self.strings[offset:offset +
+                                 self.records[record + 1]].tobytes()
+            if found < key:
+                low = middle + 1
+            elif found > key:
+                high = middle
+            else:
+                return self.sorted_ids[middle]
+
+        return None
+
+
+class StepSet():
+    """
+    This StepSet class holds the steps selected when a pipeline is executed
+    as sorted, merged ranges of step numbers, with a bitset of the same
+    steps for constant-time membership tests. Iterating over it gives the
+    step numbers, as strings, in increasing order.
+    """
+
+    def __init__(self, ranges):
+        """
+        Parameters
+        ----------
+        ranges: list
+            List of (low, high) pairs of step numbers, bounds included, in
+            any order and possibly overlapping
+
+        Modifies
+        ----------
+        self.ranges: list
+            List of disjoint, non adjacent (low, high) pairs, in increasing
+            order
+        self.bits: int
+            Bitset of the steps, bit i standing for step i
+        """
+
+        self.ranges = []
+        for low, high in sorted(ranges):
+            if self.ranges and low <= self.ranges[-1][1] + 1:
+                if high > self.ranges[-1][1]:
+                    self.ranges[-1] = (self.ranges[-1][0], high)
+            else:
+                self.ranges.append((low, high))
+
+        self.bits = 0
+        for low, high in self.ranges:
+            self.bits |= ((1 << (high - low + 1)) - 1) << low
+
+    def __contains__(self, step):
+        return int(step) >= 0 and self.bits >> int(step) & 1 == 1
+
+    def __iter__(self):
+        for low, high in self.ranges:
+            for step in range(low, high + 1):
+                yield str(step)
+
+    def __len__(self):
+        return sum(high - low + 1 for low, high in self.ranges)
+
+    def difference(self, other):
+        """
+        This function lists the steps of this set which are not in other, in
+        a single sweep over the ranges of both sets.
+
+        Parameters
+        ----------
+        other: StepSet
+            Steps to leave out
+
+        Returns
+        ----------
+        list
+            List of disjoint (low, high) pairs, in increasing order
+        """
+
+        ranges = []
+        first = 0
+        for low, high in self.ranges:
+            # skip the ranges of other ending before this one
+            while first < len(other.ranges) and \
+                    other.ranges[first][1] < low:
+                first += 1
+
+            # cut out the ranges of other overlapping this one
+            for other_low, other_high in other.ranges[first:]:
+                if other_low > high:
+                    break
+                if other_low > low:
+                    ranges.append((low, other_low - 1))
+                low = max(low, other_high + 1)
+
+            if low <= high:
+                ranges.append((low, high))
+
+        return ranges
+
+    def __str__(self):
+        return ",".join(str(low) if low == high else str(low) + "-" + str(high)
+                        for low, high in self.ranges)
+
+
+class FlowGraph():
+    """
+    This FlowGraph class holds the flowchart of one execution of a pipeline
+    in memory: the nodes and edges to draw, and the result of the validation
+    of the selected steps. Nothing is written to disk unless render is
+    called.
+    """
+
+    def __init__(self, steps, if_bam, if_fastq, nodes, edges, unsourced,
+                 find_repair=None):
+        """
+        Parameters
+        ----------
+        steps: string
+            Steps of the pipeline being run
+        if_bam: boolean
+            Stores if READSET has BAM data or not
+        if_fastq: boolean
+            Stores if READSET has FASTQ data or not
+        nodes: list
+            List of (name, label) pairs of the nodes to draw
+        edges: list
+            List of (predecessor, step) pairs of node names to link
+        unsourced: list
+            List of the selected steps which don't have a source
+        find_repair: function
+            If the steps are not interconnected, function returning the
+            repair and repaired_steps attributes, called the first time one
+            of them is read
+
+        Modifies
+        ----------
+        self.valid: boolean
+            Indicates whether a connected pipeline can be made or not
+        """
+
+        self.steps = steps
+        self.if_bam = if_bam
+        self.if_fastq = if_fastq
+        self.nodes = nodes
+        self.edges = edges
+        self.unsourced = unsourced
+        self.find_repair = find_repair
+        self.valid = not unsourced
+
+    def load_repair(self):
+        """
+        This function finds the repair of the flowchart, once.
+
+        Modifies
+        ----------
+        self.repair_result: tuple
+            Smallest list of steps to add so that the steps are
+            interconnected, and the steps with that list added, both None if
+            no such list exists
+        """
+
+        if not hasattr(self, "repair_result"):
+            self.repair_result = (None, None)
+            if self.find_repair is not None:
+                self.repair_result = self.find_repair()
+
+    @property
+    def repair(self):
+        """
+        Smallest list of steps to add so that the steps are interconnected,
+        None if no such list exists
+        """
+
+        self.load_repair()
+        return self.repair_result[0]
+
+    @property
+    def repaired_steps(self):
+        """
+        The steps with the repair added, None if there is no repair
+        """
+
+        self.load_repair()
+        return self.repair_result[1]
+
+    def lines(self):
+        """
+        This function writes the DOT source of the flowchart, line by line,
+        or of a graph holding an error message if the steps are not
+        interconnected. The source is the one the graphviz package would
+        write for the same graph.
+
+        Parameters
+        ----------
+
+        Returns
+        ----------
+        generator
+            Lines of the DOT source, each ending with a newline
+        """
+
+        yield "// Flowchart\n"
+        yield "digraph {\n"
+
+        # if graph is erroneous, create dummy graph
+        if not self.valid:
+            yield "\tnode [shape=plaintext]\n"
+
+            # add error node
+            yield "\t0 [label=" + \
+                quote("Graph not created: some nodes don't have a source") + \
+                "]\n"
+
+        else:
+            yield "\tnode [shape=rectangle]\n"
+            yield "\tedge [arrowhead=normal]\n"
+
+            # add nodes
+            for (name, label) in self.nodes:
+                yield "\t" + quote(name) + " [label=" + quote(label) + "]\n"
+
+            # add edges
+            for (i, j) in self.edges:
+                yield "\t" + quote(i) + " -> " + quote(j) + "\n"
+
+        yield "}\n"
+
+    def source(self):
+        """
+        This function returns the DOT source of the flowchart, see lines.
+
+        Parameters
+        ----------
+
+        Returns
+        ----------
+        string
+            DOT source of the flowchart
+        """
+
+        return "".join(self.lines())
+
+    def pipe(self, format="svg"):
+        """
+        This function returns the flowchart in the given format, without
+        writing any file: the DOT source as is, or the image rendered by
+        Graphviz through a pipe.
+
+        Parameters
+        ----------
+        format: string
+            One of PIPE_FORMATS
+
+        Returns
+        ----------
+        bytes
+            Flowchart in the given format
+        """
+
+        if format not in PIPE_FORMATS:
+            raise FlowChartError("unknown output format \"" + format + "\"," +
+                                 " expected one of " +
+                                 ", ".join(PIPE_FORMATS) + ".")
+
+        source = self.source().encode("utf-8")
+
+        if format == "dot":
+            return source
+
+        graphviz = import_graphviz()
+        try:
+            return graphviz.pipe("dot", format, source)
+        except graphviz.ExecutableNotFound:
+            raise FlowChartError(DOT_NOT_FOUND)
+
+    def render(self, file_name):
+        """
+        This function saves the DOT source of the flowchart to file_name and
+        renders it to file_name.pdf. Rendering forks the Graphviz binary, so
+        it is skipped when the saved source already has the same content
+        hash and the PDF was rendered from it.
+
+        Parameters
+        ----------
+        file_name: path
+            Name of the DOT source file, the PDF gets a ".pdf" suffix
+
+        Returns
+        ----------
+        boolean
+            True if the render was skipped (cache hit)
+        """
+
+        source = self.source()
+        digest = hashlib.sha256(source.encode("utf-8")).hexdigest()
+        pdf_file_name = file_name + ".pdf"
+
+        # the PDF is written after its source, an older PDF is stale
+        if os.path.exists(file_name) and os.path.exists(pdf_file_name) and \
+                os.path.getmtime(pdf_file_name) >= \
+                os.path.getmtime(file_name):
+
+            # compare text, the source is saved with platform newlines
+            with open(file_name, "r", encoding="utf-8") as f:
+                saved_digest = hashlib.sha256(
+                    f.read().encode("utf-8")).hexdigest()
+
+            if saved_digest == digest:
+                return True
+
+        graphviz = import_graphviz()
+
+        if os.path.dirname(file_name):
+            os.makedirs(os.path.dirname(file_name), exist_ok=True)
+        with open(file_name, "w", encoding="utf-8") as f:
+            f.write(source)
+
+        try:
+            graphviz.render("dot", "pdf", file_name)
+        except graphviz.ExecutableNotFound:
+            raise FlowChartError(DOT_NOT_FOUND)
+        return False
+
+
+class FlowChart():
+    """
+    This FlowChart class helps create user-friendly flow charts when a
+    pipeline is executed (either in its entirety or partially). This script
+    needs the user to select steps that are linked to each other; in other
+    words, a step can not be executed unless its predecessor is executed.
+
+    Requirements:
+
+    - a hierarchy file, specifying the predecessor(s) for each node. The
+    format for the hierarchy file is specified in the sample hierarchy file.
+
+    - steps, specified in the execution of the pipeline.
+
+    Used as a library, FlowChart(None, hierarchy_file_name) only parses the
+    hierarchy file; build then returns the in-memory FlowGraph of a set of
+    steps, without writing any file.
+
+    """
+
+    def __init__(self, steps, hierarchy_file_name, if_bam=True,
+                 if_fastq=True, cache_dir=CACHE_DIR):
+        """
+        Parameters
+        ----------
+        steps: string
+            Steps of the pipeline being run, None to only parse the hierarchy
+            file (see build and generate_batch)
+        hierarchy_file_name: string
+            Path to hierarchy_file
+        if_bam: boolean
+            Stores if READSET has BAM data or not
+        if_fastq: boolean
+            Stores if READSET has FASTQ data or not
+        cache_dir: path
+            Directory caching the parsed hierarchy files, None to disable
+
+        Modifies
+        ----------
+        self.if_bam: boolean
+            Stores if READSET has BAM data or not
+        self.if_fastq: boolean
+            Stores if READSET has FASTQ data or not
+        """
+
+        self.if_bam = if_bam
+        self.if_fastq = if_fastq
+
+        self.parse_hierarchy(hierarchy_file_name, cache_dir)
+        if steps is not None:
+            self.parse_steps(steps)
+            self.create_flowchart()
+
+    def generate_batch(self, entries, jobs=1):
+        """
+        This function creates the flowcharts of many executions of the
+        pipeline, all from the same parsed hierarchy file. An incorrect entry
+        is reported in its summary and does not stop the batch.
+
+        The graphs are built one after the other by the calling thread, while
+        up to jobs worker threads save and render them; rendering waits on a
+        Graphviz subprocess, so the renders of the batch run in parallel.
+        Entries naming the same flowchart file are rendered once, so that no
+        two workers write the same file.
+
+        Parameters
+        ----------
+        entries: list
+            List of (steps, if_bam, if_fastq, error) tuples, see read_batch
+        jobs: int
+            Maximum number of flowcharts rendered at the same time
+
+        Returns
+        ----------
+        list
+            Summaries of the flowcharts, in the order of entries
+        """
+
+        results = []
+        pending = []
+        rendered = {}
+
+        with concurrent.futures.ThreadPoolExecutor(jobs) as executor:
+            for steps, if_bam, if_fastq, error in entries:
+                result = {"steps": steps, "bam": if_bam, "fastq": if_fastq,
+                          "valid": False, "unsourced": [], "repair": None,
+                          "output": None,
+                          "cache_hit": False, "error": error}
+                results.append(result)
+
+                if error is None:
+                    try:
+                        graph = self.build(steps, if_bam, if_fastq)
+                    except (FlowChartError, ValueError) as inst:
+                        result["error"] = str(inst)
+
+                # the steps trace the message back to the batch file
+                if result["error"] is not None:
+                    print("Error: steps " + steps + ": " + result["error"])
+                    continue
+
+                result["valid"] = graph.valid
+                result["unsourced"] = graph.unsourced
+
+                # identical entries share one render of their file
+                output = self.output_name(graph)
+                if output is None or output not in rendered:
+                    saved = (self.save(graph, output, executor), graph)
+                    if output is not None:
+                        rendered[output] = saved
+                else:
+                    saved = rendered[output]
+                pending.append((result, saved))
+
+            for result, (future, graph) in pending:
+                result["output"], result["cache_hit"] = future.result()
+
+                # the worker already searched the repair of an invalid graph
+                if not graph.valid:
+                    result["repair"] = graph.repair
+
+        return results
+
+    def session(self, if_bam=True, if_fastq=True):
+        """
+        This function starts an interactive session on the parsed hierarchy
+        file, see FlowChartSession.
+
+        Parameters
+        ----------
+        if_bam: boolean
+            Stores if READSET has BAM data or not
+        if_fastq: boolean
+            Stores if READSET has FASTQ data or not
+
+        Returns
+        ----------
+        FlowChartSession
+            Session with no step selected yet
+        """
+
+        return FlowChartSession(self, if_bam, if_fastq)
+
+    def build(self, steps, if_bam=True, if_fastq=True):
+        """
+        This function builds the flowchart of one execution of the pipeline
+        in memory, without writing any file.
+
+        Parameters
+        ----------
+        steps: string
+            Steps of the pipeline being run
+        if_bam: boolean
+            Stores if READSET has BAM data or not
+        if_fastq: boolean
+            Stores if READSET has FASTQ data or not
+
+        Returns
+        ----------
+        FlowGraph
+            Flowchart and validation result of the selected steps
+        """
+
+        self.if_bam = if_bam
+        self.if_fastq = if_fastq
+
+        self.parse_steps(steps)
+
+        return self.build_graph()
+
+    def parse_steps(self, steps):
+        """
+        This functions parses the steps selected when a pipeline is executed
+        into a set of step ranges, in a single pass over the string. A range
+        left open, e.g. "5-", runs to the final step.
+
+        Example:
+
+        "1-4" becomes [1,2,3,4]
+        "1,2,3,4" becomes [1,2,3,4]
+        "1,3-5,7" becomes [1,3,4,5,7]
+        "27-" becomes [27,28,29] with the dnaseq hierarchy
+
+        Parameters
+        ----------
+        steps: string
+            String describing the steps being executed
+
+        Modifies
+        ----------
+        self.steps: string
+            String passed to the function
+        self.step_set: StepSet
+            Set of steps being executed
+        """
+
+        if steps == "":
+            raise FlowChartError("STEPS can not be empty. Please try again.")
+        self.steps = steps
+
+        ranges = []
+        for step in steps.strip().split(","):
+            low, dash, high = (bound.strip() for bound in step.partition("-"))
+
+            # an open range runs to the final step
+            if dash and high == "":
+                high = str(self.max_step)
+            elif not dash:
+                high = low
+
+            # a missing or negative bound is an error
+            if not STEP_NUMBER.match(low) or not STEP_NUMBER.match(high):
+                raise FlowChartError("The steps entered seem to be " +
+                                     "incorrect.")
+
+            # if there's a zero, exit
+            if int(low) <= 0:
+                raise FlowChartError("steps start from 1, not 0.")
+
+            # ensure all steps in STEP are <= self.max_step
+            if max(int(low), int(high)) > self.max_step:
+                raise FlowChartError("You're trying to access a step which " +
+                                     "doesn't exist.")
+            if int(low) > int(high):
+                raise FlowChartError("The steps entered seem to be " +
+                                     "incorrect.")
+
+            ranges.append((int(low), int(high)))
+
+        self.step_set = StepSet(ranges)
+
+    def parse_hierarchy(self, hierarchy_file_name, cache_dir=CACHE_DIR):
+        """
+        This function parses the hierarchy file in order to identify the
+        relation between nodes. The parsed hierarchy is cached in cache_dir,
+        and reused for as long as the hierarchy file does not change.
+
+        The file is read in a single pass (see read_hierarchy) and may be
+        gzip-compressed, or "-" for the standard input. Compiled hierarchy
+        files (see compile_hierarchy) are not parsed: the attributes below
+        are then read-only views of the file, mapped in memory.
+
+        Parameters
+        ----------
+        hierarchy_file_name: path
+            Name of file containing the relations between nodes
+        cache_dir: path
+            Directory caching the parsed hierarchy files, None to disable
+
+        Modifies
+        ----------
+        self.links: dict
+            Dictionary of links between steps
+        self.name_list: list
+            List of names of steps
+        self.hierarchy_file: string
+            Stores the path to the hierarchy_file
+        self.max_step: int
+            Stores the id of the final step in the pipeline
+        self.node_ids: dict
+            Dictionary of node ids, keyed by data source or step number
+        self.node_labels: list
+            List of data sources and step numbers, indexed by node id
+        self.predecessors: list
+            List of compiled predecessor groups, indexed by node id (None
+            for the data sources)
+        self.successors: list
+            List of the node ids having a node among their predecessors,
+            indexed by node id
+        self.closure: tuple
+            Stores the closure index, built on the first query (see
+            closure_index)
+        """
+
+        self.hierarchy_file = hierarchy_file_name
+        self.closure = None
+
+        # the standard input can be read only once, it is never cached, and
+        # compiled hierarchies are read in place, they need no cache
+        if hierarchy_file_name == "-":
+            file_name = "<stdin>"
+            cache_dir = None
+        elif self.is_compiled(hierarchy_file_name):
+            self.load_compiled(hierarchy_file_name)
+            return
+        else:
+            file_name = hierarchy_file_name
+
+        # skip the parsing if the hierarchy file is unchanged since cached
+        if cache_dir is not None and self.load_hierarchy(cache_dir):
+            return
+
+        self.links = dict()
+        self.name_list = []
+        self.max_step = 1
+
+        # the data sources take the first node ids, steps follow in order
+        self.node_ids = dict()
+        self.node_labels = []
+        for source in SOURCES:
+            self.node_ids[source] = len(self.node_labels)
+            self.node_labels.append(source)
+
+        # steps are checked as they are read, cycles once all are known
+        step_lines = dict()
+        with open_hierarchy(hierarchy_file_name) as f:
+            for line_number, predecessor_term, step_number, step_name in \
+                    read_hierarchy(f, file_name):
+                step_lines[step_number] = line_number
+                self.name_list.append(step_name)
+                self.links[step_number] = predecessor_term
+                self.node_ids[step_number] = len(self.node_labels)
+                self.node_labels.append(step_number)
+
+                # identify the final step
+                if int(step_number) > self.max_step:
+                    self.max_step = int(step_number)
+
+        if not self.links:
+            raise FlowChartError(file_name + ": no step defined.")
+
+        # compile the predecessor terms once all the step numbers are known
+        self.predecessors = [None] * len(self.node_labels)
+        for step_number, predecessor_term in self.links.items():
+            self.predecessors[self.node_ids[step_number]] = \
+                self.compile_predecessors(predecessor_term)
+
+        # reverse the predecessor groups, to walk the hierarchy downwards
+        successors = [[] for label in self.node_labels]
+        for node, group in enumerate(self.predecessors):
+            if group is not None:
+                for member in collections.OrderedDict.fromkeys(group.members):
+                    successors[member].append(node)
+        self.successors = [tuple(nodes) for nodes in successors]
+
+        # report every cycle, each at the line of its first step
+        cycles = []
+        for component in self.strongly_connected_components():
+            group = self.predecessors[component[0]]
+            if len(component) > 1 or \
+                    group is not None and component[0] in group.members:
+                steps = [self.node_labels[node] for node in component]
+                if len(steps) > 1:
+                    problem = "steps " + ", ".join(steps) + " depend on " + \
+                        "each other."
+                else:
+                    problem = "step " + steps[0] + " depends on itself."
+                cycles.append(file_name + ":" +
+                              str(step_lines[steps[0]]) + ": " + problem)
+        if cycles:
+            raise FlowChartError("\n".join(cycles))
+
+        if cache_dir is not None:
+            self.save_hierarchy(cache_dir)
+
+    def is_compiled(self, hierarchy_file_name):
+        """
+        This function tells compiled hierarchy files from text ones by their
+        first bytes.
+
+        Parameters
+        ----------
+        hierarchy_file_name: path
+            Name of the hierarchy file
+
+        Returns
+        ----------
+        boolean
+            True if the hierarchy file is compiled
+        """
+
+        with open(hierarchy_file_name, "rb") as f:
+            return f.read(len(BINARY_MAGIC)) == BINARY_MAGIC
+
+    def load_compiled(self, hierarchy_file_name):
+        """
+        This function maps a compiled hierarchy file in memory, and exposes
+        it through the attributes set by parse_hierarchy.
+
+        Parameters
+        ----------
+        hierarchy_file_name: path
+            Name of the compiled hierarchy file
+
+        Modifies
+        ----------
+        self.links, self.name_list, self.max_step, self.node_ids,
+        self.node_labels, self.predecessors, self.successors: see
+        parse_hierarchy
+        """
+
+        binary = BinaryHierarchy(hierarchy_file_name)
+        nb_steps = binary.nb_nodes - len(SOURCES)
+
+        self.links = LinksView(binary)
+        self.name_list = SequenceView(
+            nb_steps, lambda index: binary.name(index + len(SOURCES)))
+        self.max_step = binary.max_step
+        self.node_ids = NodeIdsView(binary)
+        self.node_labels = SequenceView(binary.nb_nodes, binary.label)
+        self.predecessors = SequenceView(binary.nb_nodes, binary.group)
+        self.successors = SequenceView(binary.nb_nodes, binary.successors_of)
+
+    def compile_hierarchy(self, binary_file_name):
+        """
+        This function writes the parsed hierarchy as a compiled hierarchy
+        file, which FlowChart reads in place instead of parsing it (see
+        BinaryHierarchy for the layout).
+
+        Parameters
+        ----------
+        binary_file_name: path
+            Name of the compiled hierarchy file to write
+        """
+
+        records = array.array("I")
+        predecessors = array.array("I")
+        successors = array.array("I")
+        strings = bytearray()
+
+        for node, label in enumerate(self.node_labels):
+            encoded_label = label.encode("utf-8")
+            if node < len(SOURCES):
+                encoded_name = b""
+            else:
+                encoded_name = \
+                    self.name_list[node - len(SOURCES)].encode("utf-8")
+
+            group = self.predecessors[node]
+            if group is None:
+                connector = 0
+                members = ()
+            else:
+                connector = BINARY_CONNECTORS.index(group.connector)
+                members = group.members
+
+            records.extend((len(strings), len(encoded_label),
+                            len(strings) + len(encoded_label),
+                            len(encoded_name), connector, len(predecessors),
+                            len(members), len(successors),
+                            len(self.successors[node])))
+            strings += encoded_label + encoded_name
+            predecessors.extend(members)
+            successors.extend(self.successors[node])
+
+        # node ids in the byte order of their labels, for binary search
+        sorted_ids = array.array("I", sorted(
+            range(len(self.node_labels)),
+            key=lambda node: self.node_labels[node].encode("utf-8")))
+
+        header = BINARY_HEADER.pack(BINARY_MAGIC, BINARY_MARK,
+                                    len(self.node_labels), len(predecessors),
+                                    len(successors), self.max_step,
+                                    len(strings))
+
+        with open(binary_file_name, "wb") as f:
+            f.write(header)
+            for section in (records, predecessors, successors, sorted_ids):
+                section.tofile(f)
+            f.write(strings)
+
+    def hierarchy_cache_key(self, cache_dir):
+        """
+        This function identifies the cache entry of the hierarchy file and
+        the state of the file it has to match.
+
+        Parameters
+        ----------
+        cache_dir: path
+            Directory caching the parsed hierarchy files
+
+        Returns
+        ----------
+        cache_file_name: path
+            Name of the cache entry of the hierarchy file
+        stamp: tuple
+            Absolute path, size and modification time of the hierarchy file
+        """
+
+        path = os.path.abspath(self.hierarchy_file)
+        stat = os.stat(path)
+        cache_file_name = os.path.join(
+            cache_dir, hashlib.sha1(path.encode("utf-8")).hexdigest())
+
+        return cache_file_name, (path, stat.st_size, stat.st_mtime)
+
+    def hierarchy_digest(self):
+        """
+        This function hashes the content of the hierarchy file.
+
+        Parameters
+        ----------
+
+        Returns
+        ----------
+        string
+            SHA-256 digest of the hierarchy file
+        """
+
+        with open(self.hierarchy_file, "rb") as f:
+            return hashlib.sha256(f.read()).hexdigest()
+
+    def load_hierarchy(self, cache_dir):
+        """
+        This function restores the parsed hierarchy from its cache entry.
+        The entry is used only if the content hash of the hierarchy file
+        still matches: a file edited within the resolution of its
+        modification time keeps its size and stamp, so the stamp alone
+        could serve a stale hierarchy. Hashing the file is much cheaper
+        than parsing it.
+
+        Parameters
+        ----------
+        cache_dir: path
+            Directory caching the parsed hierarchy files
+
+        Returns
+        ----------
+        boolean
+            True if the parsed hierarchy was restored from the cache
+
+        Modifies
+        ----------
+        self.links, self.name_list, self.max_step, self.node_ids,
+        self.node_labels, self.predecessors: see parse_hierarchy
+        """
+
+        try:
+            cache_file_name, stamp = self.hierarchy_cache_key(cache_dir)
+            with open(cache_file_name, "rb") as f:
+                version, cached_stamp, digest, state = marshal.load(f)
+        except (EnvironmentError, EOFError, ValueError, TypeError):
+            # missing, unreadable or outdated cache entry
+            return False
+
+        if version != CACHE_VERSION or cached_stamp[0] != stamp[0]:
+            return False
+
+        if digest != self.hierarchy_digest():
+            return False
+
+        # same content, refresh the entry of a touched or copied file
+        if cached_stamp != stamp:
+            self.write_hierarchy_cache(cache_file_name, stamp, digest, state)
+
+        for name, value in zip(HIERARCHY_ATTRIBUTES, state):
+            setattr(self, name, value)
+        self.predecessors = [None if group is None else
+                             PredecessorGroup(*group)
+                             for group in self.predecessors]
+
+        return True
+
+    def save_hierarchy(self, cache_dir):
+        """
+        This function stores the parsed hierarchy in its cache entry. The
+        cache is an optimisation only: failing to write it is not an error.
+
+        Parameters
+        ----------
+        cache_dir: path
+            Directory caching the parsed hierarchy files
+        """
+
+        try:
+            if not os.path.exists(cache_dir):
+                os.makedirs(cache_dir)
+
+            cache_file_name, stamp = self.hierarchy_cache_key(cache_dir)
+
+            # marshal only handles built-in types, store groups as tuples
+            state = [getattr(self, name) for name in HIERARCHY_ATTRIBUTES]
+            state[HIERARCHY_ATTRIBUTES.index("predecessors")] = \
+                [None if group is None else tuple(group)
+                 for group in self.predecessors]
+
+            self.write_hierarchy_cache(cache_file_name, stamp,
+                                       self.hierarchy_digest(), tuple(state))
+        except EnvironmentError:
+            pass
+
+    def write_hierarchy_cache(self, cache_file_name, stamp, digest, state):
+        """
+        This function atomically writes a cache entry, so that concurrent
+        invocations never read a partially written entry.
+
+        Parameters
+        ----------
+        cache_file_name: path
+            Name of the cache entry
+        stamp: tuple
+            Absolute path, size and modification time of the hierarchy file
+        digest: string
+            SHA-256 digest of the hierarchy file
+        state: tuple
+            Values of HIERARCHY_ATTRIBUTES
+        """
+
+        handle, temp_name = tempfile.mkstemp(
+            dir=os.path.dirname(cache_file_name))
+        try:
+            with os.fdopen(handle, "wb") as f:
+                marshal.dump((CACHE_VERSION, stamp, digest, state), f)
+            os.replace(temp_name, cache_file_name)
+        except EnvironmentError:
+            os.remove(temp_name)
+            raise
+
+    def compile_predecessors(self, predecessor_term):
+        """
+        This function compiles the predecessor term of a step into the node
+        ids of its predecessors and the connector relating them. A single
+        predecessor is treated as a "," group of one.
+
+        Example:
+
+        "5+6+8" becomes PredecessorGroup("+", (6, 7, 9))
+
+        Parameters
+        ----------
+        predecessor_term: string
+            Predecessor(s) of a step, as written in the hierarchy file
+
+        Returns
+        ----------
+        PredecessorGroup
+            Connector and node ids of the predecessors
+        """
+
+        predecessor_term = predecessor_term.strip()
+
+        # a node considers either one or all of its predecessors, not both
+        if ANY_OF in predecessor_term and ALL_OF in predecessor_term:
+            raise FlowChartError("predecessor term \"" + predecessor_term +
+                                 "\" mixes \",\" and \"+\" connectors.")
+
+        if ALL_OF in predecessor_term:
+            connector = ALL_OF
+        else:
+            connector = ANY_OF
+
+        members = []
+        for item in predecessor_term.split(connector):
+            if item not in self.node_ids:
+                raise FlowChartError("predecessor \"" + item + "\" is not a " +
+                                     "step of the hierarchy file.")
+            members.append(self.node_ids[item])
+
+        return PredecessorGroup(connector, tuple(members))
+
+    def strongly_connected_components(self):
+        """
+        This function groups the node ids into the strongly connected
+        components of the hierarchy (Tarjan's algorithm, walking up the
+        predecessors with an explicit stack). Steps of the same component
+        depend on each other; in a hierarchy without cycles, every component
+        is a single node.
+
+        Parameters
+        ----------
+
+        Returns
+        ----------
+        list
+            Lists of node ids, in increasing order, one per component; the
+            components of the predecessors of a node come before its own
+        """
+
+        nb_nodes = len(self.node_labels)
+        index = [None] * nb_nodes
+        low = [0] * nb_nodes
+        on_stack = [False] * nb_nodes
+        stack = []
+        components = []
+        visited = 0
+
+        for root in range(nb_nodes):
+            if index[root] is not None:
+                continue
+
+            # (node, position of the next predecessor to visit) pairs
+            work = [(root, 0)]
+            while work:
+                node, position = work.pop()
+                if position == 0:
+                    index[node] = low[node] = visited
+                    visited += 1
+                    stack.append(node)
+                    on_stack[node] = True
+
+                group = self.predecessors[node]
+                members = () if group is None else group.members
+                while position < len(members):
+                    member = members[position]
+                    position += 1
+                    if index[member] is None:
+                        break
+                    if on_stack[member]:
+                        low[node] = min(low[node], index[member])
+                else:
+                    member = None
+
+                # visit the predecessor first, then come back to node
+                if member is not None and index[member] is None:
+                    work.append((node, position))
+                    work.append((member, 0))
+                    continue
+
+                if low[node] == index[node]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack[member] = False
+                        component.append(member)
+                        if member == node:
+                            break
+                    components.append(sorted(component))
+
+                if work:
+                    parent = work[-1][0]
+                    low[parent] = min(low[parent], low[node])
+
+        return components
+
+    def reachable_steps(self, sources=SOURCES):
+        """
+        This function lists the steps that can have a source when the given
+        data sources are present, by a breadth-first search down the
+        successors of the sources: a step needs only one of its predecessors.
+
+        Parameters
+        ----------
+        sources: tuple
+            Data sources present
+
+        Returns
+        ----------
+        list
+            Step numbers, in the order of the hierarchy file
+        """
+
+        reached = [False] * len(self.node_labels)
+        queue = collections.deque(self.node_ids[source] for source in sources)
+        for node in queue:
+            reached[node] = True
+
+        while queue:
+            for successor in self.successors[queue.popleft()]:
+                if not reached[successor]:
+                    reached[successor] = True
+                    queue.append(successor)
+
+        return [self.node_labels[node]
+                for node in range(len(SOURCES), len(reached)) if reached[node]]
+
+    def closure_index(self):
+        """
+        This function builds, on the first query, the transitive closure of
+        the hierarchy as one bitset of node ids per node, and memoizes it
+        until the hierarchy is parsed again.
+
+        Whether its predecessors are "," or "+" separated, a step needs only
+        one of them to have a source. Its required ancestors are therefore
+        those shared by all of its predecessors (with the predecessors
+        themselves), while its possible ancestors, and the descendants of a
+        step, gather every predecessor or successor.
+
+        Parameters
+        ----------
+
+        Returns
+        ----------
+        required: list
+            Bitsets of the ancestors needed in every execution of each node,
+            indexed by node id
+        possible: list
+            Bitsets of the ancestors each node may use, indexed by node id
+        descendants: list
+            Bitsets of the nodes that may use each node, indexed by node id
+
+        Modifies
+        ----------
+        self.closure: tuple
+            Stores the memoized required, possible and descendants bitsets
+        """
+
+        if self.closure is not None:
+            return self.closure
+
+        nb_nodes = len(self.node_labels)
+
+        # parse_hierarchy made sure every component is a single node
+        order = [component[0]
+                 for component in self.strongly_connected_components()]
+
+        required = [0] * nb_nodes
+        possible = [0] * nb_nodes
+        for node in order:
+            group = self.predecessors[node]
+            if group is None:
+                continue
+
+            shared = None
+            for member in group.members:
+                member_required = required[member] | 1 << member
+                shared = member_required if shared is None else \
+                    shared & member_required
+                possible[node] |= possible[member] | 1 << member
+            required[node] = shared
+
+        descendants = [0] * nb_nodes
+        for node in reversed(order):
+            for successor in self.successors[node]:
+                descendants[node] |= descendants[successor] | 1 << successor
+
+        self.closure = required, possible, descendants
+
+        return self.closure
+
+    def closure_steps(self, step, index):
+        """
+        This function lists the steps of one bitset of the closure index.
+
+        Parameters
+        ----------
+        step: string
+            Step number whose bitset is listed
+        index: int
+            Position of the bitsets in the tuple returned by closure_index
+
+        Returns
+        ----------
+        list
+            Step numbers of the bitset, in the order of the hierarchy file
+        """
+
+        if step not in self.node_ids or step in SOURCES:
+            raise FlowChartError("step " + step + " is not a step of the " +
+                                 "hierarchy file.")
+
+        bitset = self.closure_index()[index][self.node_ids[step]]
+
+        # the data sources take the lowest bits, they are not steps
+        bitset &= ~((1 << len(SOURCES)) - 1)
+        steps = []
+        while bitset:
+            lowest = bitset & -bitset
+            bitset ^= lowest
+            steps.append(self.node_labels[lowest.bit_length() - 1])
+
+        return steps
+
+    def required_ancestors(self, step):
+        """
+        This function lists the steps that run before step in every
+        connected pipeline containing it.
+
+        Parameters
+        ----------
+        step: string
+            Step number
+
+        Returns
+        ----------
+        list
+            Step numbers, in the order of the hierarchy file
+        """
+
+        return self.closure_steps(step, 0)
+
+    def ancestors(self, step):
+        """
+        This function lists the steps whose output step may use, directly or
+        through other steps.
+
+        Parameters
+        ----------
+        step: string
+            Step number
+
+        Returns
+        ----------
+        list
+            Step numbers, in the order of the hierarchy file
+        """
+
+        return self.closure_steps(step, 1)
+
+    def descendants(self, step):
+        """
+        This function lists the steps that may use the output of step,
+        directly or through other steps, i.e. the steps to run again once
+        step is run again.
+
+        Parameters
+        ----------
+        step: string
+            Step number
+
+        Returns
+        ----------
+        list
+            Step numbers, in the order of the hierarchy file
+        """
+
+        return self.closure_steps(step, 2)
+
+    def selected_nodes(self):
+        """
+        This function lists the node ids of the selected steps, followed by
+        the node ids of the data sources present in READSET.
+
+        Parameters
+        ----------
+
+        Returns
+        ----------
+        list
+            Node ids of the selected steps and data sources
+        """
 
-    Requirements:
+        nodes = [self.node_ids[step] for step in self.step_set]
 
-    - a hierarchy file, specifying the predecessor(s) for each node. The
-    format for the hierarchy file is specified in the sample hierarchy file.
+        if self.if_bam:
+            nodes.append(self.node_ids["BAM"])
+        if self.if_fastq:
+            nodes.append(self.node_ids["FASTQ"])
 
-    - steps, specified in the execution of the pipeline.
+        return nodes
 
-    """
+    def check_validity(self):
+        """
+        This function checks if the steps inputted are continuous or not. The
+        flowchart is created only if the steps are interconnected.
+
+        Parameters
+        ----------
+
+        Returns
+        ----------
+        boolean
+            Indicates whether a connected pipeline can be made or not
+        """
 
-    def __init__(self, steps, hierarchy_file_name, if_bam, if_fastq):
+        return not self.unsourced_steps()
+
+    def unsourced_steps(self):
         """
+        This function lists the selected steps which don't have a source,
+        i.e. none of whose predecessors is executed or present in READSET.
+
         Parameters
         ----------
-        steps: string
-            Steps of the pipeline being run
-        hierarchy_file_name: string
-            Path to hierarchy_file
+
+        Returns
+        ----------
+        list
+            Step numbers of the selected steps without a source
+        """
+
+        nodes = self.selected_nodes()
+
+        # set of the selected node ids, for constant time lookups
+        selected = set(nodes)
+
+        unsourced = []
+        for node in nodes:
+            group = self.predecessors[node]
+
+            # ignore the validation for the data sources BAM and FASTQ
+            if group is None:
+                continue
+
+            # at least one of the predecessors of a step, be they "," or "+"
+            # separated, has to be executed for the step to have a source
+            if not any(member in selected for member in group.members):
+                unsourced.append(self.node_labels[node])
+
+        return unsourced
+
+    def repair_selection(self, nodes, if_bam, if_fastq, max_states=1000):
+        """
+        This function finds a smallest list of steps to add to a selection
+        so that every selected step has a source. It only reads the parsed
+        hierarchy, not the current selection, so that the repair of a
+        FlowGraph can be computed after other selections were parsed.
+
+        A breadth-first search from the selected nodes gives, for every
+        other step, the fewest steps to add to give it a source, itself
+        included, along a shortest chain of predecessors. Following such a
+        chain for each step without a source gives a repair in linear time;
+        it is the smallest when it is no longer than the chain of the step
+        needing the most, e.g. when a single step has no source.
+
+        Otherwise, a depth-first search looks for a smaller repair: it picks
+        the step without a source having the fewest candidate predecessors
+        and tries each of them in turn, deepening the number of added steps
+        one at a time. Selections are bitsets of node ids; those already
+        explored are memoized, and branches are pruned by a lower bound:
+        steps without a source whose candidate predecessors are disjoint
+        each need a different added step. The search keeps its own stack,
+        so that long repairs do not exhaust the recursion limit.
+
+        Parameters
+        ----------
+        nodes: list
+            Node ids of the selected steps and present data sources, see
+            selected_nodes
         if_bam: boolean
             Stores if READSET has BAM data or not
         if_fastq: boolean
             Stores if READSET has FASTQ data or not
+        max_states: int
+            Number of selections explored before settling for the repair of
+            the breadth-first search
 
-        Modifies
+        Returns
         ----------
-        self.if_bam: boolean
-            Stores if READSET has BAM data or not
-        self.if_fastq: boolean
-            Stores if READSET has FASTQ data or not
+        list
+            Step numbers to add, in step order (empty if the selection is
+            valid), None if no list exists
         """
 
-        self.if_bam = if_bam
-        self.if_fastq = if_fastq
-
-        self.parse_hierarchy(hierarchy_file_name)
-        self.parse_steps(steps)
-        self.create_flowchart(self.check_validity())
-
-    def parse_steps(self, steps):
+        selected_nodes = set(nodes)
+        unsourced_nodes = [node for node in nodes
+                           if self.predecessors[node] is not None and
+                           not any(member in selected_nodes for member in
+                                   self.predecessors[node].members)]
+        if not unsourced_nodes:
+            return []
+
+        # fewest steps to add to source each node, itself included, and the
+        # predecessor sourcing it on a shortest chain
+        cost = dict((node, 0) for node in nodes)
+        sourced_by = dict()
+        queue = collections.deque(nodes)
+        while queue:
+            node = queue.popleft()
+            for successor in self.successors[node]:
+                if successor not in cost:
+                    cost[successor] = cost[node] + 1
+                    sourced_by[successor] = node
+                    queue.append(successor)
+
+        # number of steps without a source each node is a predecessor of
+        shared = collections.Counter(member for node in unsourced_nodes
+                                     for member in
+                                     self.predecessors[node].members)
+
+        # connect each step without a source along a shortest chain, through
+        # the predecessor shared by the most such steps
+        chains = set()
+        longest = 0
+        for node in unsourced_nodes:
+            reachable = [member for member in self.predecessors[node].members
+                         if member in cost]
+            if not reachable:
+                return None
+            member = min(reachable,
+                         key=lambda member: (cost[member], -shared[member]))
+            longest = max(longest, cost[member])
+            while member not in selected_nodes and member not in chains:
+                chains.add(member)
+                member = sourced_by[member]
+
+        repair = chains
+        if len(chains) > longest:
+            try:
+                repair = self.search_repair(selected_nodes, unsourced_nodes,
+                                            if_bam, if_fastq, longest,
+                                            len(chains) - 1, max_states) or \
+                    chains
+            except FlowChartError:
+                # the search gave up, the chains are a repair all the same
+                pass
+
+        return sorted((self.node_labels[node] for node in repair), key=int)
+
+    def search_repair(self, selected_nodes, unsourced_nodes, if_bam,
+                      if_fastq, low, high, max_states):
         """
-        This functions parses the steps selected when a pipeline is executed
-        into a list.
+        This function searches for a repair of low to high steps by
+        iterative deepening, see repair_selection.
 
-        Example:
+        Parameters
+        ----------
+        selected_nodes: set
+            Node ids of the selected steps and present data sources
+        unsourced_nodes: list
+            Node ids of the selected steps without a source
+        if_bam: boolean
+            Stores if READSET has BAM data or not
+        if_fastq: boolean
+            Stores if READSET has FASTQ data or not
+        low: int
+            Fewest steps a repair can add
+        high: int
+            Most steps the repair may add
+        max_states: int
+            Number of selections explored before giving up
+
+        Returns
+        ----------
+        list
+            Node ids of the steps to add, None if there is no repair of at
+            most high steps
+        """
 
-        "1-4" becomes [1,2,3,4]
-        "1,2,3,4" becomes [1,2,3,4]
-        "1,3-5,7" becomes [1,3,4,5,7]
+        # data sources that are not present can never be selected
+        missing = set(self.node_ids[source] for source, present in
+                      zip(SOURCES, (if_bam, if_fastq)) if not present)
+
+        # bitsets of the candidate predecessors and successors of the nodes
+        # reached by the search, built on demand
+        candidates = dict()
+        successors = dict()
+
+        def candidates_of(node):
+            if node not in candidates:
+                candidates[node] = 0
+                for member in self.predecessors[node].members:
+                    if member not in missing:
+                        candidates[node] |= 1 << member
+            return candidates[node]
+
+        def successors_of(node):
+            if node not in successors:
+                successors[node] = 0
+                for successor in self.successors[node]:
+                    successors[node] |= 1 << successor
+            return successors[node]
+
+        # highest number of steps added explored for each selection
+        explored = dict()
+
+        def children(selected, unsourced, budget):
+            # selections adding one predecessor of the most constrained step
+            # without a source, None if no repair of budget steps can follow
+            if explored.get(selected, -1) >= budget:
+                return None
+            explored[selected] = budget
+            if len(explored) > max_states:
+                raise FlowChartError("repair search gave up.")
+
+            best = None
+            best_count = 0
+            bound = 0
+            used = 0
+            pending = unsourced
+            while pending:
+                lowest = pending & -pending
+                pending ^= lowest
+                node = lowest.bit_length() - 1
+
+                count = bin(candidates_of(node)).count("1")
+                if count == 0:
+                    return None
+                if best is None or count < best_count:
+                    best = node
+                    best_count = count
+                if candidates_of(node) & used == 0:
+                    bound += 1
+                    used |= candidates_of(node)
+
+            if bound > budget:
+                return None
+
+            selections = []
+            for member in self.predecessors[best].members:
+                if not candidates_of(best) & 1 << member:
+                    continue
+
+                # member sources its successors, and may need a source
+                added = selected | 1 << member
+                remaining = unsourced & ~successors_of(member)
+                if not candidates_of(member) & added:
+                    remaining |= 1 << member
+                selections.append((member, added, remaining))
+
+            return selections
+
+        selected = 0
+        for node in selected_nodes:
+            selected |= 1 << node
+        unsourced = 0
+        for node in unsourced_nodes:
+            unsourced |= 1 << node
+
+        for budget in range(low, high + 1):
+            # the stack holds the selections left to try at each depth, and
+            # path the steps added to reach the deepest one
+            stack = [iter(children(selected, unsourced, budget) or ())]
+            path = []
+            while stack:
+                child = next(stack[-1], None)
+                if child is None:
+                    stack.pop()
+                    if path:
+                        path.pop()
+                    continue
+
+                member, added, remaining = child
+                if not remaining:
+                    return path + [member]
+
+                selections = children(added, remaining,
+                                      budget - len(path) - 1)
+                if selections:
+                    path.append(member)
+                    stack.append(iter(selections))
+
+        return None
+
+    def member_matrix(self):
+        """
+        This function lays the predecessor groups of the steps out as the
+        rows of a matrix, padding the shorter groups by repeating their first
+        member, see check_selections.
 
         Parameters
         ----------
-        steps: string
-            String describing the steps being executed
 
-        Modifies
+        Returns
         ----------
-        self.steps: string
-            String passed to the function
-        self.step_list: list
-            List of steps being executed
+        step_nodes: list
+            Node ids of the steps
+        members: numpy.ndarray
+            Node ids of the members of the predecessor group of each step,
+            one row per step
         """
 
-        if steps == "":
-            print("Error: STEPS can not be empty. Please try again.")
-            sys.exit(0)
-        self.steps = steps
-        self.step_list = []
+        numpy = import_numpy()
 
-        comma_delimited_steps = steps.strip().split(",")
-        for step in comma_delimited_steps:
-            if "-" in step:
-                low = step.strip().split("-")[0]
-                high = step.strip().split("-")[1]
+        step_nodes = [node for node, group in enumerate(self.predecessors)
+                      if group is not None]
+        width = max(len(self.predecessors[node].members)
+                    for node in step_nodes)
+        members = numpy.array([self.predecessors[node].members +
+                               self.predecessors[node].members[:1] *
+                               (width - len(self.predecessors[node].members))
+                               for node in step_nodes])
 
-                # if either of high or low is empty -> negative integer, exit
-                if low == "" or high == "":
-                    print("Error: The steps entered seem to be incorrect.")
-                    sys.exit(0)
+        return step_nodes, members
 
-                low = int(low)
-                high = int(high)
+    def check_selections(self, selections, if_bam=True, if_fastq=True,
+                         member_matrix=None):
+        """
+        This function checks many selections of steps at once, applying the
+        rules of check_validity to a boolean matrix with one row per
+        selection and one column per node id.
 
-                # if there's a zero, exit
-                if low <= 0:
-                    print("Error: steps start from 1, not 0.")
-                    sys.exit(0)
+        Parameters
+        ----------
+        selections: list or numpy.ndarray
+            List of strings describing steps, or boolean matrix of the
+            selected node ids (the data source columns are ignored)
+        if_bam: boolean
+            Stores if READSET has BAM data or not
+        if_fastq: boolean
+            Stores if READSET has FASTQ data or not
+        member_matrix: tuple
+            Result of member_matrix, passed by callers checking selections
+            many times so that it is built once
 
-                for i in range(low, high + 1):
-                    self.step_list.append(str(i))
-            else:
-                # if there's a zero, exit
-                if int(step.strip()) <= 0:
-                    print("Error: steps start from 1, not 0.")
-                    sys.exit(0)
+        Returns
+        ----------
+        numpy.ndarray
+            Boolean vector, True for the selections making a connected
+            pipeline
+        """
 
-                self.step_list.append(step.strip())
+        numpy = import_numpy()
 
-        # sort elements of step as if they were integers
-        def natural_key(string_):
-            return [int(s) if s.isdigit() else s
-                    for s in re.split(r"(\d+)", string_)]
+        if isinstance(selections, numpy.ndarray):
+            matrix = selections.astype(bool)
+        else:
+            matrix = numpy.zeros((len(selections), len(self.node_labels)),
+                                 dtype=bool)
+            for row, steps in enumerate(selections):
+                self.parse_steps(steps)
+                matrix[row, [self.node_ids[step]
+                             for step in self.step_set]] = True
+
+        matrix[:, self.node_ids["BAM"]] = if_bam
+        matrix[:, self.node_ids["FASTQ"]] = if_fastq
+
+        if member_matrix is None:
+            member_matrix = self.member_matrix()
+        step_nodes, members = member_matrix
+
+        # one row per node id, so that gathering the members of the groups
+        # copies whole rows
+        matrix = numpy.ascontiguousarray(matrix.T)
+
+        # a step has a source if any member of its group is selected
+        sourced = matrix[members[:, 0]]
+        for column in range(1, members.shape[1]):
+            sourced |= matrix[members[:, column]]
+        selected_steps = matrix[step_nodes]
+
+        return selected_steps.any(axis=0) & \
+            ~(selected_steps & ~sourced).any(axis=0)
+
+    def valid_ranges(self, data=DATA_COMBINATIONS):
+        """
+        This function lists the contiguous step ranges "low-high" making a
+        connected pipeline, for each combination of BAM and FASTQ data.
 
-        self.step_list = list(set(self.step_list))
+        A step of the range low-high has a source if a present data source
+        or a step numbered between low and high is in its predecessor group.
+        For a given low, each step thus needs the range to reach the first
+        member of its group numbered from low on, and the range low-high is
+        valid if high reaches what every step up to high needs: one running
+        maximum per low checks all the ranges starting at low.
 
-        self.step_list.sort(key=natural_key)
+        Parameters
+        ----------
+        data: list
+            List of (if_bam, if_fastq) combinations to check
 
-        # ensure all steps in STEP are <= self.max_step
-        if int(self.step_list[len(self.step_list)-1]) > self.max_step:
-            print("Error: You're trying to access a step which doesn't exist.")
-            sys.exit(0)
+        Returns
+        ----------
+        list
+            List of (steps, if_bam, if_fastq) tuples of the valid ranges, by
+            increasing low, then combination, then increasing high
+        """
 
-    def parse_hierarchy(self, hierarchy_file_name):
+        numpy = import_numpy()
+
+        # number of the step behind each node id, 0 for the data sources
+        numbers = numpy.array([0] * len(SOURCES) +
+                              [int(label) for label in
+                               self.node_labels[len(SOURCES):]])
+
+        # the groups of the steps, by increasing step number
+        step_nodes, members = self.member_matrix()
+        order = numpy.argsort(numbers[step_nodes], kind="stable")
+        step_numbers = numbers[step_nodes][order]
+        members = members[order]
+        member_numbers = numbers[members]
+        has_bam = (members == self.node_ids["BAM"]).any(axis=1)
+        has_fastq = (members == self.node_ids["FASTQ"]).any(axis=1)
+
+        # no range reaches a member numbered beyond the final step
+        never = self.max_step + 1
+
+        valid = []
+        for first, low in enumerate(step_numbers):
+            later = member_numbers[first:]
+            needed = numpy.where(later >= low, later, never).min(axis=1)
+
+            for if_bam, if_fastq in data:
+                # a step sourced by present data needs no other step
+                sourced = (has_bam[first:] & if_bam) | \
+                    (has_fastq[first:] & if_fastq)
+                reach = numpy.maximum.accumulate(
+                    numpy.where(sourced, low, needed))
+                highs = step_numbers[first:]
+
+                for high in highs[reach <= highs]:
+                    steps = str(low)
+                    if high != low:
+                        steps += "-" + str(high)
+                    valid.append((steps, if_bam, if_fastq))
+
+        return valid
+
+    def link_nodes(self):
         """
-        This function parses the hierarchy file in order to identify the
-        relation between nodes.
+        This function collects the nodes and edges of the flowchart of the
+        selected steps. Both are kept in insertion-ordered sets, so that each
+        node and edge is added once and in the order it was first reached.
 
         Parameters
         ----------
-        hierarchy_file_name: path
-            Name of file containing the relations between nodes
 
-        Modifies
+        Returns
         ----------
-        self.links: dict
-            Dictionary of links between steps
-        self.name_list: list
-            List of names of steps
-        self.hierarchy_file: string
-            Stores the path to the hierarchy_file
-        self.max_step: int
-            Stores the id of the final step in the pipeline
+        added_nodes: OrderedDict
+            Ordered set of the data sources and step numbers to draw
+        added_tuples: OrderedDict
+            Ordered set of the (predecessor, step) edges to draw
         """
 
-        self.links = dict()
-        self.name_list = []
-        self.hierarchy_file = hierarchy_file_name
-        self.max_step = 1
+        # store all the nodes that have been added so far
+        added_nodes = collections.OrderedDict()
+
+        # store all the edges that have been added so far
+        added_tuples = collections.OrderedDict()
 
-        with open(hierarchy_file_name, "r") as f:
-            for line in f:
+        nodes = self.selected_nodes()
+        selected = set(nodes)
 
-                # ignoring commented lines
-                if line[0] != "#":
+        # hard code the BAM, FASTQ node if present
+        if self.if_bam:
+            added_nodes["BAM"] = None
+        if self.if_fastq:
+            added_nodes["FASTQ"] = None
 
-                    # replacing multiple intercolumnar tabs by a single tab
-                    line = "\t".join(line.split())
-                    splitted = line.split("\t")
+        for node in nodes:
+            group = self.predecessors[node]
+            if group is None:
+                continue
 
-                    predecessor_term = splitted[0]
-                    step_term = splitted[1]
-                    step_number = step_term.split(":")[0]
-                    step_name = step_term.split(":")[1]
-                    self.name_list.append(step_name)
-                    self.links[step_number] = predecessor_term
+            # add a node for step, unless it is already added
+            step = self.node_labels[node]
+            added_nodes.setdefault(step)
 
-                    # identify the final step
-                    if int(step_number) > self.max_step:
-                        self.max_step = int(step_number)
+            for member in group.members:
 
-    def check_validity(self):
+                # if there actually exists a link between this predecessor
+                # and step, proceed
+                if member in selected:
+                    item = self.node_labels[member]
+
+                    added_tuples.setdefault((item, step))
+
+                    # add a node for item, unless it is already added
+                    added_nodes.setdefault(item)
+
+                    # if step has multiple predecessors of which one has to
+                    # be chosen, only one link needs to be considered
+                    if group.connector == ANY_OF:
+                        break
+
+        return added_nodes, added_tuples
+
+    def build_graph(self):
         """
-        This function checks if the steps inputted are continuous or not. The
-        flowchart is created only if the steps are interconnected.
+        This function builds the flowchart of the selected steps in memory.
 
         Parameters
         ----------
 
-        Modifies
+        Returns
         ----------
-
+        FlowGraph
+            Flowchart and validation result of the selected steps
         """
-        # make a copy of the list of steps
-        temp_list = self.step_list[:]
 
-        # add BAM/FASTQ to the copy of list of steps to account for top nodes
-        if self.if_bam:
-            temp_list.append("BAM")
-        if self.if_fastq:
-            temp_list.append("FASTQ")
+        unsourced = self.unsourced_steps()
 
-        for step in temp_list:
-            # ignore the validation for dummy values BAM and FASTQ
-            if step == "BAM" or step == "FASTQ":
-                continue
+        # if graph is erroneous, there is nothing to draw but a repair,
+        # only searched for if it is read
+        if unsourced:
+            nodes = self.selected_nodes()
+            step_set = self.step_set
+            if_bam = self.if_bam
+            if_fastq = self.if_fastq
+
+            def find_repair():
+                repair = self.repair_selection(nodes, if_bam, if_fastq)
+                if repair is None:
+                    return None, None
+                return repair, format_steps(list(step_set) + repair)
 
-            # pred = predecessor(s) of step
-            pred = self.links[step]
+            return FlowGraph(self.steps, self.if_bam, self.if_fastq, [], [],
+                             unsourced, find_repair)
 
-            # if step has only one predecessor
-            if "," not in pred and "+" not in pred:
-                if pred not in temp_list:
-                    return False
+        added_nodes, added_tuples = self.link_nodes()
 
+        # label the steps with their names
+        nodes = []
+        for i in added_nodes:
+            if i in SOURCES:
+                nodes.append((i, i))
             else:
-                # if pred has multiple predecessors
-                separator_list = [",", "+"]
-                for separator in separator_list:
-                    if separator in pred:
-                        pred_list = pred.strip().split(separator)
-
-                        # initialize flag to false, set flag to true if any
-                        # one of the mandated predecessors exists in the list
-                        flag = False
-                        for item in pred_list:
-                            if item in temp_list:
-                                flag = True
-
-                        if not flag:
-                            return False
+                nodes.append((i, i + ":" + self.name_list[int(i) - 1]))
 
-        return True
+        return FlowGraph(self.steps, self.if_bam, self.if_fastq, nodes,
+                         list(added_tuples), unsourced)
 
-    def create_flowchart(self, verity):
+    def create_flowchart(self):
         """
         This function uses the consecution module and builds a flowchart of
-        the steps involved in the process.
+        the steps involved in the process, then saves it in the flowcharts
+        folder.
 
         Parameters
         ----------
-        verity: boolean
-            Indicates whether a connected pipeline can be made or not
 
-        Modifies
+        Returns
+        ----------
+        output: path
+            Name of the saved flowchart, None if none was saved
+        cache_hit: boolean
+            True if the flowchart was already up to date
+        """
+
+        graph = self.build_graph()
+
+        return self.save(graph, self.output_name(graph))
+
+    def output_name(self, graph):
+        """
+        This function names the flowchart file of an execution after the
+        hierarchy file, the steps and the data present in READSET.
+
+        Parameters
         ----------
+        graph: FlowGraph
+            Flowchart of the execution
 
+        Returns
+        ----------
+        path
+            Name of the flowchart file, None if READSET has neither BAM nor
+            FASTQ data
         """
 
-        # if graph is erroneous, create dummy file and exit
-        if not verity:
+        if graph.if_bam and graph.if_fastq:
+            data = ".bam.fastq"
+        elif graph.if_bam:
+            data = ".bam"
+        elif graph.if_fastq:
+            data = ".fastq"
+        else:
+            return None
 
-            # create a graph using Graphviz
-            dot = Digraph(comment="Flowchart",
-                          node_attr={"shape": "plaintext"})
+        if graph.valid:
+            extension = ".flow"
+        else:
+            extension = ".error"
 
-            # add error node
-            dot.node("0", "Graph not created: some nodes don't have a source")
+        return OUTPUT_DIR + self.hierarchy_file + "-" + graph.steps + data + \
+            extension
 
-            try:
-                # create folder if not exists
-                dir_name = "flowcharts/"
-                if not os.path.exists(dir_name):
-                    os.makedirs(dir_name)
+    def save(self, graph, output, executor=None):
+        """
+        This function saves and renders a flowchart in the flowcharts folder.
 
-                if self.if_bam and self.if_fastq:
-                    dot.render(dir_name + self.hierarchy_file + "-" +
-                               self.steps + ".bam.fastq.error")
+        Parameters
+        ----------
+        graph: FlowGraph
+            Flowchart to save
+        output: path
+            Name of the flowchart file, see output_name
+        executor: Executor
+            If given, the flowchart is saved by the executor and a Future of
+            the return value is returned instead
+
+        Returns
+        ----------
+        output: path
+            Name of the saved flowchart, None if none was saved
+        cache_hit: boolean
+            True if the flowchart was already up to date
+        """
 
-                if self.if_bam and not self.if_fastq:
-                    dot.render(dir_name + self.hierarchy_file + "-" +
-                               self.steps + ".bam.error")
+        if executor is not None:
+            return executor.submit(self.save, graph, output)
 
-                if not self.if_bam and self.if_fastq:
-                    dot.render(dir_name + self.hierarchy_file + "-" +
-                               self.steps + ".fastq.error")
+        cache_hit = False
 
+        try:
+            # create folder if not exists, possibly from several workers
+            os.makedirs(OUTPUT_DIR, exist_ok=True)
+
+            # save graph
+            if output is not None:
+                cache_hit = graph.render(output)
+                if cache_hit:
+                    print("Render cache hit: " + output + ".pdf is up to " +
+                          "date.")
+                else:
+                    print("Render cache miss: rendered " + output + ".pdf.")
+
+            if graph.valid:
+                print("Flowchart saved successfully.")
+            else:
                 print("Error: some nodes don't have a source.")
+                if graph.repair is not None:
+                    print("Adding step(s) " + ",".join(graph.repair) +
+                          " would connect them: --steps " +
+                          graph.repaired_steps)
 
-            except Exception as inst:
+        except FlowChartError:
+            # missing Graphviz, reported as is
+            raise
 
-                # raise exception if file is open and can not be modified
-                print("The target file seems to be open already. Please" +
-                      " close the file before proceeding.")
+        except Exception as inst:
+            # raise exception if file is open and can not be modified
+            print("The target file seems to be open already. Please" +
+                  " close the file before proceeding.")
+            return None, False
 
-            return
+        return output, cache_hit
 
-        # store all the nodes that have been added so far
-        added_nodes = []
 
-        # store all the edges that have been added so far
-        added_tuples = []
+class FlowChartSession():
+    """
+    This FlowChartSession class keeps the validation state of a selection
+    of steps while a user adds and removes steps from it, e.g. in a step
+    picker. Each change only updates the steps linked to the changed ones,
+    so checking the selection does not depend on the size of the pipeline.
 
-        # creating a copy of self.step_list with BAM/FASTQ in it
-        temp_list = self.step_list[:]
+    For every node, the session counts how many of its predecessors are
+    selected; a selected step without a source is one whose count is zero.
+    """
 
-        # hard code the BAM, FASTQ node if present
-        if self.if_bam:
-            added_nodes.append("BAM")
-            temp_list.append("BAM")
-        if self.if_fastq:
-            added_nodes.append("FASTQ")
-            temp_list.append("FASTQ")
+    def __init__(self, chart, if_bam=True, if_fastq=True):
+        """
+        Parameters
+        ----------
+        chart: FlowChart
+            FlowChart whose hierarchy file is parsed
+        if_bam: boolean
+            Stores if READSET has BAM data or not
+        if_fastq: boolean
+            Stores if READSET has FASTQ data or not
 
-        for step in temp_list:
-            if step == "BAM" or step == "FASTQ":
-                continue
+        Modifies
+        ----------
+        self.step_set: StepSet
+            Selected steps
+        self.selected: set
+            Node ids of the selected steps and data sources
+        self.support: list
+            Number of selected predecessors of each node, by node id
+        self.unsourced: set
+            Node ids of the selected steps without a source
+        """
+
+        self.chart = chart
+        self.steps = ""
+        self.step_set = StepSet([])
+        self.selected = set()
+        self.support = [0] * len(chart.node_labels)
+        self.unsourced = set()
+
+        self.set_data(if_bam, if_fastq)
+
+    def set_data(self, if_bam, if_fastq):
+        """
+        This function updates the data present in READSET.
+
+        Parameters
+        ----------
+        if_bam: boolean
+            Stores if READSET has BAM data or not
+        if_fastq: boolean
+            Stores if READSET has FASTQ data or not
+        """
+
+        self.if_bam = if_bam
+        self.if_fastq = if_fastq
+
+        for source, present in zip(SOURCES, (if_bam, if_fastq)):
+            if present:
+                self.add_node(self.chart.node_ids[source])
+            else:
+                self.remove_node(self.chart.node_ids[source])
 
-            # if step has only one predecessor
-            if "," not in self.links[step] and "+" not in self.links[step]:
+    def select(self, steps):
+        """
+        This function replaces the selected steps, only updating the steps
+        that were added or removed since the previous selection. These are
+        found by comparing the ranges of both selections, so the cost of a
+        change does not depend on the number of selected steps.
+
+        Example:
 
-                # if step is not added, add a node for step
-                if step not in added_nodes:
-                    added_nodes.append(step)
+        select("1-10") then select("1-12,17") adds steps 11, 12 and 17
 
-                # if link[step] is not added, add a node for link[step]
-                if self.links[step] not in added_nodes:
-                    added_nodes.append(self.links[step])
+        Parameters
+        ----------
+        steps: string
+            String describing the steps being executed
 
-                added_tuples.append((self.links[step], step))
+        Returns
+        ----------
+        boolean
+            Indicates whether a connected pipeline can be made or not
+        """
 
-            # if step has multiple predecessors of which one has to be chosen
-            if "," in self.links[step]:
+        self.chart.parse_steps(steps)
+        step_set = self.chart.step_set
+        node_ids = self.chart.node_ids
 
-                # if step is not added, add a node for step
-                if step not in added_nodes:
-                    added_nodes.append(step)
+        for low, high in self.step_set.difference(step_set):
+            for step in range(low, high + 1):
+                self.remove_node(node_ids[str(step)])
+        for low, high in step_set.difference(self.step_set):
+            for step in range(low, high + 1):
+                self.add_node(node_ids[str(step)])
 
-                pred_list = self.links[step].strip().split(",")
-                for item in pred_list:
+        self.steps = steps
+        self.step_set = step_set
 
-                    # if there actually exists a link between this predecessor
-                    # and step, proceed
-                    if item in temp_list:
+        return self.valid()
 
-                        added_tuples.append((item, step))
+    def add_node(self, node):
+        """
+        This function selects a step or data source.
 
-                        # if item is not added, add a node for item
-                        if item not in added_nodes:
-                            added_nodes.append(item)
+        Parameters
+        ----------
+        node: int
+            Node id of the step or data source
+        """
 
-                        # since only one link needs to considered, break
-                        break
+        if node in self.selected:
+            return
+        self.selected.add(node)
 
-            # if step has multiple predecessors of which all can chosen
-            if "+" in self.links[step]:
+        # the successors of node now have one more selected predecessor
+        for successor in self.chart.successors[node]:
+            self.support[successor] += 1
+            self.unsourced.discard(successor)
 
-                # if step is not added, add a node for step
-                if step not in added_nodes:
-                    added_nodes.append(step)
+        if self.chart.predecessors[node] is not None and \
+                self.support[node] == 0:
+            self.unsourced.add(node)
 
-                pred_list = self.links[step].strip().split("+")
-                for item in pred_list:
+    def remove_node(self, node):
+        """
+        This function unselects a step or data source.
 
-                    # if there actually exists a link between this predecessor
-                    # and step, proceed
-                    if item in temp_list:
+        Parameters
+        ----------
+        node: int
+            Node id of the step or data source
+        """
 
-                        added_tuples.append((item, step))
+        if node not in self.selected:
+            return
+        self.selected.remove(node)
+        self.unsourced.discard(node)
 
-                        # if item is not added, add a node for item
-                        if item not in added_nodes:
-                            added_nodes.append(item)
+        # the successors of node now have one less selected predecessor
+        for successor in self.chart.successors[node]:
+            self.support[successor] -= 1
+            if self.support[successor] == 0 and successor in self.selected:
+                self.unsourced.add(successor)
 
-        # create a graph using Graphviz
-        dot = Digraph(comment="Flowchart", node_attr={"shape": "rectangle"})
+    def valid(self):
+        """
+        This function checks if the selected steps are interconnected.
 
-        # add nodes
-        for i in added_nodes:
-            if i == "BAM":
-                dot.node(i, "BAM")
-            if i == "FASTQ":
-                dot.node(i, "FASTQ")
-            if i != "BAM" and i != "FASTQ":
-                dot.node(i, i + ":" + self.name_list[int(i) - 1])
+        Parameters
+        ----------
 
-        # add edges
-        for (i, j) in added_tuples:
-            dot.edge(i, j)
+        Returns
+        ----------
+        boolean
+            Indicates whether a connected pipeline can be made or not
+        """
 
-        dot.edge_attr.update(arrowhead="normal")
+        return bool(self.steps) and not self.unsourced
 
-        try:
-            # create folder if not exists
-            dir_name = "flowcharts/"
-            if not os.path.exists(dir_name):
-                os.makedirs(dir_name)
+    def unsourced_steps(self):
+        """
+        This function lists the selected steps which don't have a source.
 
-            # save graph
-            if self.if_bam and self.if_fastq:
-                dot.render(dir_name + self.hierarchy_file + "-" + self.steps +
-                           ".bam.fastq.flow")
+        Parameters
+        ----------
 
-            if self.if_bam and not self.if_fastq:
-                dot.render(dir_name + self.hierarchy_file + "-" + self.steps +
-                           ".bam.flow")
+        Returns
+        ----------
+        list
+            Step numbers of the selected steps without a source
+        """
 
-            if not self.if_bam and self.if_fastq:
-                dot.render(dir_name + self.hierarchy_file + "-" + self.steps +
-                           ".fastq.flow")
+        return [self.chart.node_labels[node]
+                for node in sorted(self.unsourced)]
 
-            print("Flowchart saved successfully.")
+    def build(self):
+        """
+        This function builds the flowchart of the current selection.
 
-        except Exception as inst:
-            # raise exception if file is open and can not be modified
-            print("The target file seems to be open already. Please" +
-                  " close the file before proceeding.")
+        Parameters
+        ----------
+
+        Returns
+        ----------
+        FlowGraph
+            Flowchart and validation result of the selected steps
+        """
+
+        return self.chart.build(self.steps, self.if_bam, self.if_fastq)
 
 
 if __name__ == "__main__":
@@ -431,36 +2801,163 @@ if __name__ == "__main__":
     desc_string = "Creating flowcharts for GenPipe pipeline executions"
     parser = argparse.ArgumentParser(description=desc_string)
 
-    # add compulsory argument steps
-    parser.add_argument("--steps", nargs=1, required=True,
-                        help="step range e.g. \"1-5\", \"3,6,7\", \"2,4-8\"")
+    # add compulsory argument steps, or a batch file of steps
+    steps_group = parser.add_mutually_exclusive_group(required=True)
+    steps_group.add_argument("--steps", nargs=1,
+                             help="step range e.g. \"1-5\", \"3,6,7\", " +
+                             "\"2,4-8\", \"5-\" up to the final step")
+    steps_group.add_argument("--batch", nargs=1,
+                             help="file listing one \"STEPS [BAM [FASTQ]]\"" +
+                             " flowchart per line, \"-\" for stdin")
+    steps_group.add_argument("--valid_ranges", action="store_true",
+                             help="list the step ranges making a connected " +
+                             "pipeline, for each BAM/FASTQ combination")
+    steps_group.add_argument("--check", action="store_true",
+                             help="check the hierarchy file for cycles and " +
+                             "for steps that no data can reach")
+    steps_group.add_argument("--compile", nargs=1, metavar="BINARY_FILE",
+                             help="compile the hierarchy file into a " +
+                             "binary file, read in place when given as " +
+                             "--h_file")
+    steps_group.add_argument("--ancestors", nargs=1, metavar="STEP",
+                             help="list the steps required before, and " +
+                             "possibly used by, this step")
+    steps_group.add_argument("--descendants", nargs=1, metavar="STEP",
+                             help="list the steps possibly using the output " +
+                             "of this step")
 
     # add compulsory argument hierarchy file
     parser.add_argument("--h_file", nargs=1, required=True,
                         help="path to hierarchy file for pipeline")
 
-    # function to accept and convert values for --bam and --fastq
-    def str2bool(v):
-        if v.lower() in ("yes", "true", "t", "y", "1"):
-            return True
-        elif v.lower() in ("no", "false", "f", "n", "0"):
-            return False
-        else:
-            raise argparse.ArgumentTypeError("Boolean value expected.")
-
     # add optional argument bam
-    parser.add_argument("--bam", type=str2bool, nargs=1, default=True,
+    parser.add_argument("--bam", type=str2bool, default=True,
                         help="mention if SAM/BAM data is present in READSET")
 
     # add optional argument fastq
-    parser.add_argument("--fastq", type=str2bool, nargs=1, default=True,
+    parser.add_argument("--fastq", type=str2bool, default=True,
                         help="mention if FASTQ is present in READSET")
 
+    # add optional argument stdout
+    parser.add_argument("--stdout", nargs=1, choices=PIPE_FORMATS,
+                        help="write the flowchart to standard output in " +
+                        "this format instead of saving it in " + OUTPUT_DIR)
+
+    # add optional argument jobs
+    parser.add_argument("--jobs", type=int, default=1,
+                        help="number of flowcharts of a batch rendered in " +
+                        "parallel")
+
+    # add optional argument manifest
+    parser.add_argument("--manifest", nargs=1,
+                        help="path to the JSON summary of a batch, " +
+                        "defaults to " + OUTPUT_DIR + "H_FILE.manifest.json")
+
+    # add optional argument no_cache
+    parser.add_argument("--no_cache", action="store_true",
+                        help="parse the hierarchy file without using the " +
+                        "cache in " + CACHE_DIR)
+
     args = parser.parse_args()
 
+    if args.jobs < 1:
+        parser.error("argument --jobs: must be at least 1")
+    if args.stdout and not args.steps:
+        parser.error("argument --stdout: only allowed with argument --steps")
+
+    # keep standard output for the flowchart itself when piping it
+    messages = sys.stderr if args.stdout else sys.stdout
+
     # convert args to usable format
-    steps = (args.steps[0]).replace("'", "")
     h_file = (args.h_file[0]).replace("'", "")
 
+    cache_dir = None if args.no_cache else CACHE_DIR
+
     # start the program logic
-    FlowChart(steps, h_file, args.bam, args.fastq)
+    try:
+        if args.steps and args.stdout:
+            steps = (args.steps[0]).replace("'", "")
+            chart = FlowChart(None, h_file, cache_dir=cache_dir)
+            graph = chart.build(steps, args.bam, args.fastq)
+
+            # the error graph is written out too, as in flowcharts/
+            if args.stdout[0] == "dot":
+                sys.stdout.writelines(graph.lines())
+            else:
+                sys.stdout.buffer.write(graph.pipe(args.stdout[0]))
+            sys.stdout.flush()
+            if not graph.valid:
+                print("Error: some nodes don't have a source.", file=messages)
+
+        elif args.steps:
+            steps = (args.steps[0]).replace("'", "")
+            FlowChart(steps, h_file, args.bam, args.fastq, cache_dir)
+
+        elif args.valid_ranges:
+            chart = FlowChart(None, h_file, cache_dir=cache_dir)
+            for steps, if_bam, if_fastq in chart.valid_ranges():
+                print(steps + "\t" + ("yes" if if_bam else "no") + "\t" +
+                      ("yes" if if_fastq else "no"))
+
+        elif args.check:
+            chart = FlowChart(None, h_file, cache_dir=cache_dir)
+            for source in SOURCES:
+                print("reachable from " + source + "\t" +
+                      format_steps(chart.reachable_steps((source,))))
+
+            # parse_hierarchy rejects cycles, without which every step can
+            # be reached, but compiled files are not parsed again
+            unreachable = set(chart.node_labels[len(SOURCES):]) - \
+                set(chart.reachable_steps())
+            if unreachable:
+                raise FlowChartError("step(s) " + format_steps(unreachable) +
+                                     " can not be reached from BAM or " +
+                                     "FASTQ data.")
+            print("No cycle, every step can be reached.")
+
+        elif args.compile:
+            chart = FlowChart(None, h_file, cache_dir=cache_dir)
+            chart.compile_hierarchy(args.compile[0])
+            print("Hierarchy compiled to " + args.compile[0] + ".")
+
+        elif args.ancestors:
+            step = (args.ancestors[0]).replace("'", "")
+            chart = FlowChart(None, h_file, cache_dir=cache_dir)
+            print("required\t" + format_steps(chart.required_ancestors(step)))
+            print("possible\t" + format_steps(chart.ancestors(step)))
+
+        elif args.descendants:
+            step = (args.descendants[0]).replace("'", "")
+            chart = FlowChart(None, h_file, cache_dir=cache_dir)
+            print(format_steps(chart.descendants(step)))
+
+        else:
+            if args.batch[0] == "-":
+                entries = read_batch(sys.stdin)
+            else:
+                with open(args.batch[0], "r") as f:
+                    entries = read_batch(f)
+
+            # parse the hierarchy file once for the whole batch
+            chart = FlowChart(None, h_file, cache_dir=cache_dir)
+            results = chart.generate_batch(entries, args.jobs)
+
+            if args.manifest:
+                manifest = args.manifest[0]
+            else:
+                manifest = OUTPUT_DIR + h_file + ".manifest.json"
+            if os.path.dirname(manifest) and \
+                    not os.path.exists(os.path.dirname(manifest)):
+                os.makedirs(os.path.dirname(manifest))
+            with open(manifest, "w") as f:
+                json.dump({"hierarchy_file": h_file, "flowcharts": results},
+                          f, indent=2)
+
+            print(str(len(results)) + " flowcharts processed, summary " +
+                  "saved to " + manifest + ".")
+
+    except FlowChartError as inst:
+        print("Error: " + str(inst), file=messages)
+
+        # a failed check has to fail the scripts running it
+        sys.exit(1 if args.check else 0)
@@ -0,0 +1,592 @@
+# MIT License
+# Copyright (c) 2018 Devang Thakkar
+# https://www.devangthakkar.com
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# PEP-8 format: Limit all lines to a maximum of 79 characters ----------------|
+
+# Python Standard Modules
+import argparse
+import asyncio
+import collections
+import concurrent.futures
+import glob
+import http
+import json
+import os
+import shutil
+import traceback
+import urllib.parse
+
+# Import FlowChart
+from flowchart import CACHE_DIR, DOT_NOT_FOUND, PIPE_FORMATS, FlowChart, \
+    FlowChartError, str2bool
+
+# content type of the flowcharts, by format
+CONTENT_TYPES = {"dot": "text/vnd.graphviz", "svg": "image/svg+xml",
+                 "png": "image/png", "pdf": "application/pdf"}
+
+
+class QueueFullError(Exception):
+    """
+    Raised when a render is requested while the render queue is full. The
+    server answers 503 Service Unavailable, asking the client to retry.
+    """
+
+
+class RenderError(Exception):
+    """
+    Raised when Graphviz fails to render a flowchart, or is not installed.
+    The failure lies with the server and not with the query, so the server
+    answers 502 Bad Gateway.
+    """
+
+
+class RenderQueue():
+    """
+    This RenderQueue class renders DOT sources with Graphviz subprocesses,
+    at most jobs at a time. Requests wait in a bounded queue: once it is
+    full, new requests are refused instead of piling up. A request for a
+    flowchart that is already queued or being rendered waits for that
+    render instead of starting another one.
+    """
+
+    def __init__(self, jobs=4, max_pending=64):
+        """
+        Parameters
+        ----------
+        jobs: int
+            Maximum number of Graphviz subprocesses running at the same time
+        max_pending: int
+            Maximum number of renders waiting for a subprocess
+
+        Modifies
+        ----------
+        self.in_flight: dict
+            Future of each queued or running render, keyed by request
+        self.counters: dict
+            Number of renders done, failed, coalesced and refused so far
+        """
+
+        self.jobs = jobs
+        self.max_pending = max_pending
+        self.in_flight = dict()
+        self.running = 0
+        self.counters = {"rendered": 0, "failed": 0, "coalesced": 0,
+                         "rejected": 0}
+
+    def start(self):
+        """
+        This function creates the queue and starts the workers. It has to be
+        called from the running event loop.
+        """
+
+        self.queue = asyncio.Queue(self.max_pending)
+        self.workers = [asyncio.ensure_future(self.work())
+                        for i in range(self.jobs)]
+
+    async def render(self, key, source, format):
+        """
+        This function renders a DOT source, or waits for the identical
+        render already in flight.
+
+        Parameters
+        ----------
+        key: tuple
+            Identifies the flowchart, see FlowChartServer.query
+        source: bytes
+            DOT source of the flowchart
+        format: string
+            Output format of Graphviz
+
+        Returns
+        ----------
+        bytes
+            Rendered flowchart
+        """
+
+        if key in self.in_flight:
+            self.counters["coalesced"] += 1
+            return await asyncio.shield(self.in_flight[key])
+
+        future = asyncio.get_event_loop().create_future()
+        try:
+            self.queue.put_nowait((key, source, format, future))
+        except asyncio.QueueFull:
+            self.counters["rejected"] += 1
+            raise QueueFullError("too many flowcharts waiting to be " +
+                                 "rendered, retry later.")
+
+        self.in_flight[key] = future
+        return await asyncio.shield(future)
+
+    async def work(self):
+        """
+        This function runs one worker, rendering queued requests one after
+        the other until it is cancelled.
+        """
+
+        while True:
+            key, source, format, future = await self.queue.get()
+            self.running += 1
+            try:
+                process = await asyncio.create_subprocess_exec(
+                    "dot", "-T" + format, stdin=asyncio.subprocess.PIPE,
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.PIPE)
+                output, errors = await process.communicate(source)
+
+                if process.returncode != 0:
+                    raise RenderError("Graphviz failed: " +
+                                      errors.decode("utf-8", "replace"))
+
+                self.counters["rendered"] += 1
+                future.set_result(output)
+
+            except Exception as inst:
+                self.counters["failed"] += 1
+                future.set_exception(inst)
+
+            finally:
+                self.running -= 1
+                del self.in_flight[key]
+                self.queue.task_done()
+
+    def metrics(self):
+        """
+        This function reports the state of the queue.
+
+        Parameters
+        ----------
+
+        Returns
+        ----------
+        dict
+            Queue depth, running renders and counters
+        """
+
+        metrics = {"queued": self.queue.qsize(), "running": self.running,
+                   "max_pending": self.max_pending, "jobs": self.jobs}
+        metrics.update(self.counters)
+
+        return metrics
+
+
+class FlowChartServer():
+    """
+    This FlowChartServer class answers flowchart queries from a resident
+    process, over HTTP on localhost or over a Unix socket. Every hierarchy
+    file of a directory is parsed once at startup, and the rendered
+    flowcharts are kept in a least recently used cache.
+
+    Queries:
+
+    GET /flowchart?hierarchy=hierarchy_dnaseq.tsv&steps=1-29&bam=yes
+        &fastq=no&format=svg
+
+    returns the flowchart (format defaults to svg, bam and fastq to yes).
+    The X-Flowchart-Valid header tells if the steps are interconnected, and
+    X-Cache if the flowchart came from the cache.
+
+    GET /hierarchies
+
+    returns the JSON list of the loaded hierarchy files.
+
+    GET /metrics
+
+    returns the JSON state of the render queue and of the cache.
+
+    Images are rendered by a RenderQueue. When it is full, queries answer
+    503 Service Unavailable with a Retry-After header, and a failed render
+    answers 502 Bad Gateway. Graphs are built one at a time by a worker
+    thread, so that a long build does not hold up the other connections.
+    """
+
+    def __init__(self, hierarchy_dir, cache_size=256, cache_dir=CACHE_DIR,
+                 jobs=4, max_pending=64):
+        """
+        Parameters
+        ----------
+        hierarchy_dir: path
+            Directory of the hierarchy files (*.tsv) to serve
+        cache_size: int
+            Maximum number of rendered flowcharts kept in memory
+        cache_dir: path
+            Directory caching the parsed hierarchy files, None to disable
+        jobs: int
+            Maximum number of Graphviz subprocesses running at the same time
+        max_pending: int
+            Maximum number of renders waiting for a subprocess
+
+        Modifies
+        ----------
+        self.charts: dict
+            FlowChart of each hierarchy file, keyed by file name
+        self.artifacts: OrderedDict
+            Rendered flowcharts, from least to most recently used
+        self.builder: ThreadPoolExecutor
+            Single worker thread building the graphs, FlowChart keeping the
+            state of the build it is running
+        """
+
+        self.charts = dict()
+        for file_name in sorted(glob.glob(os.path.join(hierarchy_dir,
+                                                       "*.tsv"))):
+            self.charts[os.path.basename(file_name)] = \
+                FlowChart(None, file_name, cache_dir=cache_dir)
+
+        if not self.charts:
+            raise FlowChartError("no hierarchy file (*.tsv) found in " +
+                                 hierarchy_dir + ".")
+
+        self.cache_size = cache_size
+        self.artifacts = collections.OrderedDict()
+        self.cache_hits = 0
+        self.renders = RenderQueue(jobs, max_pending)
+        self.builder = concurrent.futures.ThreadPoolExecutor(1)
+
+    def build_source(self, hierarchy, steps, if_bam, if_fastq):
+        """
+        This function builds the flowchart of one execution of a pipeline
+        and returns its DOT source, see query.
+
+        Parameters
+        ----------
+        hierarchy: string
+            File name of the hierarchy file of the pipeline
+        steps: string
+            Steps of the pipeline being run
+        if_bam: boolean
+            Stores if READSET has BAM data or not
+        if_fastq: boolean
+            Stores if READSET has FASTQ data or not
+
+        Returns
+        ----------
+        valid: boolean
+            Indicates whether a connected pipeline can be made or not
+        source: bytes
+            DOT source of the flowchart
+        """
+
+        graph = self.charts[hierarchy].build(steps, if_bam, if_fastq)
+
+        return graph.valid, graph.source().encode("utf-8")
+
+    async def query(self, hierarchy, steps, if_bam, if_fastq, format):
+        """
+        This function returns the flowchart of one execution of a pipeline,
+        from the cache if it was already rendered.
+
+        Parameters
+        ----------
+        hierarchy: string
+            File name of the hierarchy file of the pipeline
+        steps: string
+            Steps of the pipeline being run
+        if_bam: boolean
+            Stores if READSET has BAM data or not
+        if_fastq: boolean
+            Stores if READSET has FASTQ data or not
+        format: string
+            One of PIPE_FORMATS
+
+        Returns
+        ----------
+        valid: boolean
+            Indicates whether a connected pipeline can be made or not
+        artifact: bytes
+            Flowchart in the given format
+        cache_hit: boolean
+            True if the flowchart came from the cache
+        """
+
+        if hierarchy not in self.charts:
+            raise FlowChartError("unknown hierarchy file \"" + hierarchy +
+                                 "\".")
+        if format not in PIPE_FORMATS:
+            raise FlowChartError("unknown output format \"" + format + "\"," +
+                                 " expected one of " +
+                                 ", ".join(PIPE_FORMATS) + ".")
+
+        # only the images need Graphviz, not the DOT source
+        if format != "dot" and shutil.which("dot") is None:
+            raise RenderError(DOT_NOT_FOUND)
+
+        key = (hierarchy, steps, if_bam, if_fastq, format)
+        if key in self.artifacts:
+            self.artifacts.move_to_end(key)
+            valid, artifact = self.artifacts[key]
+            self.cache_hits += 1
+            return valid, artifact, True
+
+        # graphs are built by the builder thread, images are rendered by
+        # the render queue
+        valid, source = await asyncio.get_event_loop().run_in_executor(
+            self.builder, self.build_source, hierarchy, steps, if_bam,
+            if_fastq)
+        if format == "dot":
+            artifact = source
+        else:
+            artifact = await self.renders.render(key, source, format)
+
+        self.artifacts[key] = (valid, artifact)
+        if len(self.artifacts) > self.cache_size:
+            self.artifacts.popitem(last=False)
+
+        return valid, artifact, False
+
+    async def handle(self, reader, writer):
+        """
+        This function answers one HTTP request, then closes the connection.
+
+        Parameters
+        ----------
+        reader: StreamReader
+            Stream of the request
+        writer: StreamWriter
+            Stream of the response
+        """
+
+        try:
+            request_line = await reader.readline()
+
+            # headers are not used, read up to the blank line ending them
+            line = await reader.readline()
+            while line not in (b"\r\n", b"\n", b""):
+                line = await reader.readline()
+
+            try:
+                method, target, version = \
+                    request_line.decode("latin-1").split()
+            except ValueError:
+                self.respond(writer, http.HTTPStatus.BAD_REQUEST,
+                             "malformed request line")
+                return
+
+            url = urllib.parse.urlsplit(target)
+            params = dict((name, values[-1]) for name, values in
+                          urllib.parse.parse_qs(url.query).items())
+
+            if method != "GET":
+                self.respond(writer, http.HTTPStatus.METHOD_NOT_ALLOWED,
+                             "only GET is supported")
+
+            elif url.path == "/hierarchies":
+                self.respond(writer, http.HTTPStatus.OK,
+                             json.dumps(sorted(self.charts)),
+                             "application/json")
+
+            elif url.path == "/metrics":
+                metrics = {"cached": len(self.artifacts),
+                           "cache_size": self.cache_size,
+                           "cache_hits": self.cache_hits}
+                metrics.update(self.renders.metrics())
+                self.respond(writer, http.HTTPStatus.OK,
+                             json.dumps(metrics, sort_keys=True),
+                             "application/json")
+
+            elif url.path == "/flowchart":
+                await self.handle_flowchart(writer, params)
+
+            else:
+                self.respond(writer, http.HTTPStatus.NOT_FOUND,
+                             "unknown path " + url.path)
+
+            await writer.drain()
+
+        except ConnectionError:
+            pass
+
+        except Exception:
+            # a bug, not a bad request: log it and still answer the client
+            traceback.print_exc()
+            try:
+                self.respond(writer, http.HTTPStatus.INTERNAL_SERVER_ERROR,
+                             "internal error, see the server log")
+                await writer.drain()
+            except ConnectionError:
+                pass
+
+        finally:
+            writer.close()
+
+    async def handle_flowchart(self, writer, params):
+        """
+        This function answers a /flowchart query.
+
+        Parameters
+        ----------
+        writer: StreamWriter
+            Stream of the response
+        params: dict
+            Parameters of the query
+        """
+
+        try:
+            if "hierarchy" not in params or "steps" not in params:
+                raise FlowChartError("the hierarchy and steps parameters " +
+                                     "are required.")
+
+            if_bam = str2bool(params.get("bam", "yes"))
+            if_fastq = str2bool(params.get("fastq", "yes"))
+            format = params.get("format", "svg")
+
+            valid, artifact, cache_hit = await self.query(
+                params["hierarchy"], params["steps"], if_bam, if_fastq,
+                format)
+
+        except QueueFullError as inst:
+            self.respond(writer, http.HTTPStatus.SERVICE_UNAVAILABLE,
+                         str(inst), headers={"Retry-After": "1"})
+            return
+
+        except RenderError as inst:
+            self.respond(writer, http.HTTPStatus.BAD_GATEWAY, str(inst))
+            return
+
+        except (FlowChartError, ValueError, argparse.ArgumentTypeError) as \
+                inst:
+            self.respond(writer, http.HTTPStatus.BAD_REQUEST, str(inst))
+            return
+
+        self.respond(writer, http.HTTPStatus.OK, artifact,
+                     CONTENT_TYPES[format],
+                     {"X-Flowchart-Valid": "yes" if valid else "no",
+                      "X-Cache": "hit" if cache_hit else "miss"})
+
+    def respond(self, writer, status, body, content_type="text/plain",
+                headers=None):
+        """
+        This function writes an HTTP response.
+
+        Parameters
+        ----------
+        writer: StreamWriter
+            Stream of the response
+        status: HTTPStatus
+            Status of the response
+        body: bytes or string
+            Body of the response, strings are encoded in UTF-8
+        content_type: string
+            Content type of the body
+        headers: dict
+            Additional headers of the response
+        """
+
+        if isinstance(body, str):
+            body = (body + "\n").encode("utf-8")
+
+        lines = ["HTTP/1.1 " + str(status.value) + " " + status.phrase,
+                 "Content-Type: " + content_type,
+                 "Content-Length: " + str(len(body)),
+                 "Connection: close"]
+        for name, value in (headers or {}).items():
+            lines.append(name + ": " + value)
+
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+        writer.write(body)
+
+    async def serve(self, port=None, socket_path=None):
+        """
+        This function serves queries until the process is stopped.
+
+        Parameters
+        ----------
+        port: int
+            Port to listen to on localhost
+        socket_path: path
+            Unix socket to listen to, instead of a port
+        """
+
+        self.renders.start()
+
+        if socket_path is not None:
+            server = await asyncio.start_unix_server(self.handle,
+                                                     path=socket_path)
+            address = socket_path
+        else:
+            server = await asyncio.start_server(self.handle, "127.0.0.1",
+                                                port)
+            address = "http://127.0.0.1:" + str(port)
+
+        print("Serving " + str(len(self.charts)) + " hierarchy files on " +
+              address + ".")
+
+        async with server:
+            await server.serve_forever()
+
+
+if __name__ == "__main__":
+
+    # description of parser
+    desc_string = "Serving flowcharts for GenPipe pipeline executions"
+    parser = argparse.ArgumentParser(description=desc_string)
+
+    # add compulsory argument hierarchy directory
+    parser.add_argument("--h_dir", nargs=1, required=True,
+                        help="directory of the hierarchy files to serve")
+
+    # add optional argument port, or a unix socket
+    address_group = parser.add_mutually_exclusive_group()
+    address_group.add_argument("--port", type=int, default=8000,
+                               help="port to listen to on localhost")
+    address_group.add_argument("--socket", nargs=1,
+                               help="path to a unix socket to listen to " +
+                               "instead of a port")
+
+    # add optional argument cache_size
+    parser.add_argument("--cache_size", type=int, default=256,
+                        help="number of rendered flowcharts kept in memory")
+
+    # add optional argument jobs
+    parser.add_argument("--jobs", type=int, default=4,
+                        help="number of flowcharts rendered in parallel")
+
+    # add optional argument max_pending
+    parser.add_argument("--max_pending", type=int, default=64,
+                        help="number of flowcharts waiting to be rendered " +
+                        "before queries are refused")
+
+    # add optional argument no_cache
+    parser.add_argument("--no_cache", action="store_true",
+                        help="parse the hierarchy files without using the " +
+                        "cache in " + CACHE_DIR)
+
+    args = parser.parse_args()
+
+    if args.jobs < 1:
+        parser.error("argument --jobs: must be at least 1")
+    if args.max_pending < 1:
+        parser.error("argument --max_pending: must be at least 1")
+
+    cache_dir = None if args.no_cache else CACHE_DIR
+    socket_path = args.socket[0] if args.socket else None
+
+    try:
+        server = FlowChartServer(args.h_dir[0], args.cache_size, cache_dir,
+                                 args.jobs, args.max_pending)
+        asyncio.run(server.serve(args.port, socket_path))
+
+    except FlowChartError as inst:
+        print("Error: " + str(inst))
+
+    except KeyboardInterrupt:
+        pass